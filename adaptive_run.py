@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Spend PHITS histories in stages until a threshold decision is settled """
+
+import os
+import copy
+import numpy as np
+import runner
+from monitor import Progress
+from output_parser import combine
+
+
+class Decision:
+    def __init__(self, passed:bool, value:float, error:float,
+                 histories:int, stages:list):
+        self.passed = passed
+        self.value = value
+        self.error = error
+        self.histories = histories
+        self.stages = stages
+
+    def __repr__(self):
+        return 'Decision(passed={}, value={:.4g}, error={:.3f}, ' \
+               'histories={}, stages={})'.format(
+                self.passed, self.value, self.error, self.histories,
+                len(self.stages))
+
+
+class AdaptiveRun:
+    """ Decide ``value > threshold and error < max_error`` cheaply
+
+    The deck is run in stages of independent histories, each in its own
+    workdir/stage<k>/ with its own rseed.  measure(path) reads the
+    quantity and its relative error from a finished stage; the stages are
+    combined with output_parser.combine.  Starting from maxcas histories
+    per batch, further stages are only run while the decision is still
+    open, i.e. the value is within z standard deviations of threshold or
+    its error is above max_error but could still be brought below it
+    within max_histories.
+
+    With early set, each stage runs with itall=1 so PHITS rewrites its
+    tallies after every batch; they are measured as they appear and the
+    stage is terminated once the decision is settled (see EarlyStop).
+    Stages found in cache (a run_cache.RunCache) are not run again, and
+    completed ones are added to it.
+    """
+    def __init__(self, deck, workdir:str, measure, threshold:float,
+                 command:list, max_error:float=0.1, maxcas:int=10000,
+                 max_histories:int=800000, z:float=2.0, echo:bool=False,
+                 early:bool=False, interval:float=5., cache=None):
+        self.deck = deck
+        self.workdir = workdir
+        self.measure = measure
+        self.threshold = threshold
+        self.command = command
+        self.max_error = max_error
+        self.maxcas = maxcas
+        self.max_histories = max_histories
+        self.z = z
+        self.echo = echo
+        self.early = early
+        self.interval = interval
+        self.cache = cache
+        self.params = next(s for s in deck.__dict__.values()
+                           if type(s).__name__ == 'Parameters')
+
+    def _stage(self, k:int, maxcas:int, stages:list):
+        path = os.path.join(self.workdir, 'stage' + str(k))
+        os.makedirs(path, exist_ok=True)
+        deck = copy.deepcopy(self.deck)
+        params = next(s for s in deck.__dict__.values()
+                      if type(s).__name__ == 'Parameters')
+        params.maxcas = maxcas
+        params.rseed = float(k + 1)
+        stop = None
+        if self.early:
+            params.itall = 1
+            stop = EarlyStop(self, path, stages)
+        if self.cache is None or not self.cache.fetch(deck, path):
+            deck.save(os.path.join(path, 'phits.in'))
+            returncode = runner.run(self.command, path, echo=self.echo,
+                                    stop=stop, interval=self.interval)
+            if stop is not None and stop.stopped:
+                return stop.last
+            if self.cache is not None and returncode == 0:
+                self.cache.store(deck, path)
+        value, error = self.measure(path)
+        return value, error, maxcas * params.maxbch
+
+    def _decided(self, value:float, error:float, histories:int):
+        sigma = abs(value) * error
+        if value + self.z * sigma < self.threshold:
+            return False
+        if error < self.max_error and value - self.z * sigma > self.threshold:
+            return True
+        needed = histories * (error / self.max_error) ** 2
+        if error >= self.max_error and needed > self.max_histories:
+            return False
+        if histories >= self.max_histories:
+            return value > self.threshold and error < self.max_error
+        return None
+
+    def run(self) -> Decision:
+        maxbch = self.params.maxbch
+        stages, maxcas = [], self.maxcas
+        while True:
+            stages.append(self._stage(len(stages), maxcas, stages))
+            values, errors, histories = np.array(stages).T
+            value, error = combine(values, errors, histories)
+            total = int(histories.sum())
+            passed = self._decided(float(value), float(error), total)
+            if passed is not None:
+                return Decision(passed, float(value), float(error), total, stages)
+            # aim straight for max_error, but at least double the total
+            needed = total * (float(error) / self.max_error) ** 2
+            more = min(max(needed - total, total), self.max_histories - total)
+            maxcas = max(1, int(np.ceil(more / maxbch)))
+
+
+class EarlyStop:
+    """ stop() hook of runner.run for one stage of an AdaptiveRun
+
+    Whenever the batch count in the stage's stdout grew, the per-batch
+    tallies are measured and combined with the finished stages.  Only
+    the confident outcomes end the run: the value z standard deviations
+    below threshold, or above it with the error already under max_error.
+    The first min_batches batches are ignored as their errors are not yet
+    meaningful.  last holds the (value, error, histories) used.
+    """
+    def __init__(self, run:AdaptiveRun, path:str, stages:list,
+                 min_batches:int=3):
+        self.run = run
+        self.path = path
+        self.stages = list(stages)
+        self.min_batches = min_batches
+        self.progress = Progress(path)
+        self.histories = 0
+        self.last = None
+        self.stopped = False
+
+    def settled(self, value:float, error:float) -> bool:
+        sigma = abs(value) * error
+        if value + self.run.z * sigma < self.run.threshold:
+            return True
+        return error < self.run.max_error and \
+               value - self.run.z * sigma > self.run.threshold
+
+    def __call__(self) -> bool:
+        status = self.progress.poll()
+        if status['batch'] < self.min_batches or \
+                status['histories'] <= self.histories:
+            return False
+        self.histories = status['histories']
+        try:
+            value, error = self.run.measure(self.path)
+        except Exception:
+            # caught PHITS rewriting the tally; try again next poll
+            return False
+        self.last = (value, error, self.histories)
+        values, errors, histories = np.array(self.stages + [self.last]).T
+        value, error = combine(values, errors, histories)
+        self.stopped = self.settled(float(value), float(error))
+        return self.stopped
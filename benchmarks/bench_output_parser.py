@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Parse-time benchmark of the output_parser readers on synthetic files
+
+    python benchmarks/bench_output_parser.py [--scale 50] [--save]
+
+Writes synthetic ANGEL files of controllable size into a scratch folder,
+parses each one in --rounds fresh interpreters (best of --repeat parses
+each) and reports the fastest MB/s, pages/s and the peak RSS the parse
+adds on top of the interpreter with numpy and pandas imported.  Results
+are compared with the baseline.json entry of the same --scale (--save
+rewrites it); readers slower, or using more memory, than baseline by
+more than --tolerance are flagged.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+HEADER = """[ T - C r o s s ]
+    title = synthetic benchmark tally
+     mesh =  {mesh}
+     axis =  {axis}
+     part =  {part}
+#-----------------------------------------------------------------------
+"""
+
+
+def write_table(path:str, pages:int, bins:int, particles:list,
+                lower:str='e', summary:int=4, seed:int=0):
+    """ T-Cross style file: per page a bins x (2 + 2*particles) table """
+    rng = np.random.default_rng(seed)
+    edges = np.logspace(-9, 3, bins + 1)
+    head = '#  {0}-lower      {0}-upper   '.format(lower) + ''.join(
+            '  {}      r.err '.format(p) for p in particles) + '\n'
+    with open(path, 'w') as f:
+        f.write(HEADER.format(mesh='r-z', axis='eng', part=' '.join(particles)))
+        for page in range(1, pages + 1):
+            f.write(' newpage:\n#   no. = {:4d}   ir =   1   iz = {:4d}\n'
+                    ' x: Energy [MeV]\n y: Current [1/source]\n'
+                    ' h: n   y(all),l0  n\n'.format(page, page))
+            f.write(head)
+            data = rng.random((bins, 2 * len(particles)))
+            data[:, 1::2] *= 0.1
+            for i in range(bins):
+                f.write('  {:.4E}  {:.4E}'.format(edges[i], edges[i + 1])
+                        + ''.join('  {:.4E}  {:.4f}'.format(*data[i, j:j + 2])
+                                  for j in range(0, data.shape[1], 2)) + '\n')
+            f.write('\n#   sum over\n w: graph\n  space  information\n'
+                    '   r-z mesh: iz = {}\n'.format(page))
+            for k in range(summary):
+                f.write('   w{}  &=&  {:.4E}  [cm]\n'.format(k, rng.random()))
+            f.write('e:\n\n')
+
+
+def write_deposit(path:str, pages:int, regions:int, seed:int=0):
+    """ T-Deposit style file: per page one row per region """
+    rng = np.random.default_rng(seed)
+    with open(path, 'w') as f:
+        f.write(HEADER.format(mesh='reg', axis='reg', part='all'))
+        for page in range(1, pages + 1):
+            f.write(' newpage:\n#   no. = {:4d}\n h: n\n'
+                    '#   num   reg     volume     all     r.err\n'.format(page))
+            for i in range(regions):
+                f.write('  {:5d}  {:5d}  1.0000E+00  {:.4E}  {:.4f}\n'.format(
+                        i + 1, 100 + i, rng.random(), 0.1 * rng.random()))
+            f.write('#   sum over\ne:\n')
+
+
+def write_track(path:str, pages:int, nx:int, nz:int, seed:int=0):
+    """ T-Track axis=xz style file: per page an nz x nx contour block """
+    rng = np.random.default_rng(seed)
+    with open(path, 'w') as f:
+        f.write(HEADER.format(mesh='xyz', axis='xz', part='neutron'))
+        for page in range(1, pages + 1):
+            f.write(' newpage:\n#   no. = {:4d}   ie = {:4d}\n'
+                    '#   nx = {:4d}   nz = {:4d}\n#   ny =    1\n'
+                    ' x: x [cm]\n y: z [cm]\n'.format(page, page, nx, nz))
+            f.write(' hc:  y =  1.5E+02 to -2.0E+01 by -1.7E+00 ;'
+                    ' x = -5.0E+01 to  5.0E+01 by  1.0E+00 ;\n')
+            v = rng.random(nx * nz)
+            for i in range(0, v.size, 10):
+                f.write(''.join(' {:.4E}'.format(x) for x in v[i:i + 10]) + '\n')
+            f.write('#  gshow\n w: graph\n  space  information\n'
+                    '   volume  &=&  1.0000E+00  [cm^3]\n'
+                    '   part.  &=&  neutron \ne:\n')
+
+
+def cases(scale:int) -> dict:
+    """ name -> (reader class, writer, writer kwargs) """
+    return {
+        'ForwardCurrent': ('ForwardCurrent', write_table, dict(
+                pages=200 * scale, bins=50, particles=['proton', 'neutron'])),
+        'CrossReg': ('CrossReg', write_table, dict(
+                pages=200 * scale, bins=50,
+                particles=['proton', 'neutron', 'photon'])),
+        'ForwardCurrentAngle': ('ForwardCurrentAngle', write_table, dict(
+                pages=200 * scale, bins=50,
+                particles=['proton', 'neutron'], lower='a')),
+        'DepositReg': ('DepositReg', write_deposit, dict(
+                pages=200 * scale, regions=100)),
+        'TrackXZ': ('TrackXZ', write_track, dict(
+                pages=10 * scale, nx=200, nz=200)),
+    }
+
+
+def _rss() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(reader:str, path:str, repeat:int=10, budget:float=3.) -> dict:
+    """ Parse path with reader in this process, keeping the best time of
+    up to repeat parses (fewer once budget seconds have been spent) """
+    import output_parser
+    cls = getattr(output_parser, reader)
+    # ru_maxrss is a high-water mark: take it once the imports are done
+    # so that only the memory of the parse itself is reported
+    before = _rss()
+    elapsed, spent = None, 0.
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = cls(path, cache=False)
+        took = time.perf_counter() - start
+        pages = sum(1 for k in result.__dict__ if k.startswith('page'))
+        del result
+        if i == 0:
+            # later parses reuse freed memory but can fragment it
+            peak = _rss() - before
+        elapsed = took if elapsed is None else min(elapsed, took)
+        spent += took
+        if spent > budget:
+            break
+    size = os.path.getsize(path) / 1e6
+    return {'seconds': elapsed, 'MB': size, 'pages': pages,
+            'MB/s': size / elapsed, 'pages/s': pages / elapsed,
+            'peak MB': peak}
+
+
+def run(scale:int, folder:str, repeat:int=10, rounds:int=3) -> dict:
+    """ Fastest of rounds fresh interpreters per reader, with the slowest
+    round kept as 'slowest MB/s' (what --save records as the baseline) """
+    results = {}
+    for name, (reader, writer, kwargs) in cases(scale).items():
+        path = os.path.join(folder, name + '.out')
+        writer(path, **kwargs)
+        found = []
+        for i in range(rounds):
+            out = subprocess.run(
+                    [sys.executable, __file__, '--measure', reader, path,
+                     '--repeat', str(repeat)],
+                    check=True, capture_output=True, text=True).stdout
+            found.append(json.loads(out))
+        found.sort(key=lambda r: r['MB/s'])
+        results[name] = dict(found[-1],
+                             **{'slowest MB/s': found[0]['MB/s'],
+                                'peak MB': max(r['peak MB'] for r in found)})
+    return results
+
+
+def report(results:dict, baseline:dict, tolerance:float,
+           slack:float=16.) -> bool:
+    """ Print results against baseline; memory counts as regressed only
+    beyond slack MB, the noise of small files """
+    ok = True
+    print('{:<20} {:>8} {:>9} {:>10} {:>8} {:>9} {:>9}'.format(
+            'reader', 'MB', 'MB/s', 'pages/s', 'peak MB', 'vs base',
+            'mem base'))
+    for name, r in results.items():
+        ratio, memory, flag = '', '', ''
+        if name in baseline:
+            base = baseline[name]
+            ratio = r['MB/s'] / base['MB/s']
+            if ratio < 1 - tolerance:
+                flag, ok = '  REGRESSION', False
+            ratio = '{:.2f}x'.format(ratio)
+            if 'peak MB' in base:
+                limit = max(base['peak MB'] * (1 + tolerance),
+                            base['peak MB'] + slack)
+                if r['peak MB'] > limit:
+                    flag, ok = '  MEMORY', False
+                memory = '{:.0f}'.format(base['peak MB'])
+        print('{:<20} {:8.1f} {:9.1f} {:10.0f} {:8.0f} {:>9} {:>9}{}'.format(
+                name, r['MB'], r['MB/s'], r['pages/s'], r['peak MB'],
+                ratio, memory, flag))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=int, default=1,
+                        help='multiplies the number of pages of every file')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--keep', help='write the synthetic files here')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='parses per interpreter, the fastest one counts')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='fresh interpreters per reader')
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(*args.measure, repeat=args.repeat)))
+        return
+    folder = args.keep or tempfile.mkdtemp(prefix='phits_bench_')
+    os.makedirs(folder, exist_ok=True)
+    try:
+        results = run(args.scale, folder, args.repeat, args.rounds)
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder)
+    # one entry per scale, so small and large files are compared apart
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    scale = str(args.scale)
+    ok = report(results, baselines.get(scale, {}), args.tolerance)
+    if args.save:
+        # timings drift with the load of the machine over minutes: the
+        # best of a later run is held against the slowest round here, so
+        # only a parser slower by more than that drift is flagged
+        baselines[scale] = {name: dict(r, **{'MB/s': r['slowest MB/s']})
+                            for name, r in results.items()}
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+    sys.exit(0 if ok or args.save else 1)
+
+
+if __name__ == '__main__':
+    main()
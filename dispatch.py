@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Dispatch PHITS jobs over several machines through pluggable backends
+
+    python dispatch.py worker <queue root> --cores 48
+
+A Dispatcher hands every runner.Job to the first backend with enough free
+cores.  Backends render the deck into the job's local workdir, run it in
+an isolated directory (never by chdir) and leave the outputs back in the
+local workdir:
+
+    Local       processes on this machine
+    Remote      one host reached through a transport: SSH, or FakeHost
+                (a local directory standing in for a host, for testing)
+    Queue       a directory on a shared filesystem served by workers
+"""
+
+import os
+import json
+import time
+import hashlib
+import shlex
+import shutil
+import asyncio
+import traceback
+import argparse
+import runner
+from runner import Job, Result, PHITS
+
+
+def _command(job:Job, executable, mpirun) -> list:
+    executable = [executable] if isinstance(executable, str) else list(executable)
+    if mpirun is None:
+        return executable
+    return [mpirun, '-np', str(job.np)] + executable
+
+
+def _copy(source:str, target:str, exclude=()):
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(source):
+        path = os.path.join(source, name)
+        if name not in exclude and os.path.isfile(path):
+            shutil.copyfile(path, os.path.join(target, name))
+
+
+class Local:
+    """ Runs jobs as local processes with cwd set to their workdir """
+    def __init__(self, cores:int, executable=PHITS, mpirun='mpirun',
+                 echo:bool=False):
+        self.cores = cores
+        self.executable = executable
+        self.mpirun = mpirun
+        self.echo = echo
+        self.name = 'local'
+
+    async def execute(self, job:Job) -> int:
+        job.prepare()
+        echo = runner._print if self.echo else None
+        return await runner._capture(
+                _command(job, self.executable, self.mpirun), job.workdir, echo)
+
+
+class FakeHost:
+    """ Transport to a pretend host whose filesystem is a local directory """
+    def __init__(self, name:str, root:str):
+        self.name = name
+        self.root = root
+
+    def path(self, key:str) -> str:
+        return os.path.join(self.root, key)
+
+    async def ship(self, workdir:str, key:str):
+        _copy(workdir, self.path(key))
+
+    async def execute(self, key:str, command:list, workdir:str, echo=None) -> int:
+        return await runner._capture(command, self.path(key), echo)
+
+    async def fetch(self, key:str, workdir:str):
+        _copy(self.path(key), workdir)
+
+    async def remove(self, key:str):
+        shutil.rmtree(self.path(key), ignore_errors=True)
+
+
+class SSH:
+    """ Transport over ssh/scp to host, jobs living under root there """
+    def __init__(self, host:str, root:str, ssh:str='ssh', scp:str='scp'):
+        self.name = host
+        self.host = host
+        self.root = root
+        self.ssh = ssh
+        self.scp = scp
+
+    def path(self, key:str) -> str:
+        return self.root.rstrip('/') + '/' + key
+
+    async def _call(self, *command) -> int:
+        process = await asyncio.create_subprocess_exec(*command)
+        return await process.wait()
+
+    async def ship(self, workdir:str, key:str):
+        code = await self._call(self.ssh, self.host,
+                                'mkdir -p ' + shlex.quote(self.path(key)))
+        if code:
+            raise OSError('mkdir on {} failed'.format(self.host))
+        files = [os.path.join(workdir, f) for f in os.listdir(workdir)
+                 if os.path.isfile(os.path.join(workdir, f))]
+        code = await self._call(self.scp, '-q', *files,
+                                '{}:{}/'.format(self.host, self.path(key)))
+        if code:
+            raise OSError('scp to {} failed'.format(self.host))
+
+    async def execute(self, key:str, command:list, workdir:str, echo=None) -> int:
+        # the remote shell changes directory, this process never does;
+        # stdout/stderr stream back into workdir as for local jobs
+        remote = 'cd {} && exec {}'.format(
+                shlex.quote(self.path(key)), ' '.join(map(shlex.quote, command)))
+        return await runner._capture([self.ssh, self.host, remote], workdir, echo)
+
+    async def fetch(self, key:str, workdir:str):
+        await self._call(self.scp, '-q', '-r',
+                         '{}:{}/*'.format(self.host, self.path(key)), workdir)
+
+    async def remove(self, key:str):
+        await self._call(self.ssh, self.host,
+                         'rm -rf -- ' + shlex.quote(self.path(key)))
+
+
+class Remote:
+    """ Runs jobs on one host through a transport (SSH or FakeHost)
+
+    The deck is rendered into the local workdir, shipped to the host
+    under a key unique to the workdir, run there and everything it
+    wrote is copied back into the local workdir; the copy on the host is
+    removed afterwards unless keep is set.
+    """
+    def __init__(self, transport, cores:int, executable=PHITS,
+                 mpirun='mpirun', echo:bool=False, keep:bool=False):
+        self.transport = transport
+        self.cores = cores
+        self.executable = executable
+        self.mpirun = mpirun
+        self.echo = echo
+        self.keep = keep
+        self.name = transport.name
+
+    async def execute(self, job:Job) -> int:
+        job.prepare()
+        key = _key(job)
+        echo = None
+        if self.echo:
+            prefix = '[{}@{}] '.format(job.name, self.name)
+            echo = lambda line: print(prefix + line.decode(errors='replace').rstrip())
+        await self.transport.ship(job.workdir, key)
+        try:
+            return await self.transport.execute(
+                    key, _command(job, self.executable, self.mpirun),
+                    job.workdir, echo)
+        finally:
+            await self.transport.fetch(key, job.workdir)
+            if not self.keep:
+                await self.transport.remove(key)
+
+
+def _key(job:Job) -> str:
+    tag = hashlib.sha1(os.path.abspath(job.workdir).encode()).hexdigest()[:8]
+    return '{}-{}'.format(job.name, tag)
+
+
+class Queue:
+    """ Hands jobs to workers through a directory on a shared filesystem
+
+    A job is written to root/pending/<key>/ (deck and job.json) with an
+    atomic rename; a worker (serve(), run on each node) claims it by
+    renaming it into root/running/, runs it there and moves it to
+    root/done/ with its returncode.  The dispatcher polls for it and
+    copies the outputs back.  cores is the number of cores the workers
+    offer together, so the dispatcher does not over-fill the queue.
+    With timeout (seconds) set, a job not done by then is withdrawn from
+    pending/ if no worker has claimed it and TimeoutError is raised.
+    """
+    def __init__(self, root:str, cores:int, poll:float=2.,
+                 timeout:float=None):
+        self.root = root
+        self.cores = cores
+        self.poll = poll
+        self.timeout = timeout
+        self.name = 'queue:' + root
+        for state in ('pending', 'running', 'done'):
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+
+    async def execute(self, job:Job) -> int:
+        job.prepare()
+        key = _key(job)
+        done = os.path.join(self.root, 'done', key)
+        if os.path.isdir(done):
+            shutil.rmtree(done)
+        tmp = os.path.join(self.root, 'pending', '.' + key)
+        _copy(job.workdir, tmp)
+        with open(os.path.join(tmp, 'job.json'), 'w') as f:
+            json.dump({'name': job.name, 'np': job.np}, f)
+        pending = os.path.join(self.root, 'pending', key)
+        os.rename(tmp, pending)
+        code = os.path.join(done, 'returncode')
+        start = time.time()
+        while not os.path.exists(code):
+            if self.timeout is not None and time.time() - start > self.timeout:
+                try:
+                    os.rename(pending, tmp)
+                    shutil.rmtree(tmp)
+                except OSError:
+                    pass    # claimed by a worker, left to finish there
+                raise TimeoutError('{} not done after {} s'.format(
+                        job.name, self.timeout))
+            await asyncio.sleep(self.poll)
+        _copy(done, job.workdir, exclude=('job.json', 'returncode'))
+        with open(code) as f:
+            returncode = int(f.read())
+        shutil.rmtree(done)
+        return returncode
+
+
+def serve(root:str, cores:int, executable=PHITS, mpirun='mpirun',
+          poll:float=2., once:bool=False, echo:bool=False):
+    """ Worker side of Queue: claim pending jobs and run them with a
+    runner.Scheduler of cores cores; once returns when the queue is empty
+
+    Jobs are claimed in order only while the worker's free cores cover
+    their np, so workers on other nodes get the rest of the queue.
+    """
+    for state in ('pending', 'running', 'done'):
+        os.makedirs(os.path.join(root, state), exist_ok=True)
+    scheduler = runner.Scheduler(cores, executable, mpirun, echo=echo)
+    host = '{}.{}'.format(os.uname().nodename, os.getpid())
+    free = cores
+
+    def spec(key):
+        try:
+            with open(os.path.join(root, 'pending', key, 'job.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None     # taken by another worker meanwhile
+
+    async def claim(key, spec, n):
+        nonlocal free
+        try:
+            running = os.path.join(root, 'running', host + '.' + key)
+            try:
+                os.rename(os.path.join(root, 'pending', key), running)
+            except OSError:
+                return      # taken by another worker
+            deck = os.path.join(running, scheduler.deckname)
+            try:
+                result = await scheduler.submit(
+                        Job(deck, running, spec['np'], spec['name']))
+                returncode = result.returncode
+            except Exception:
+                # e.g. a missing executable: report it as a failed run so
+                # the dispatcher does not wait for it forever
+                with open(os.path.join(running, 'stderr.txt'), 'a') as f:
+                    f.write(traceback.format_exc())
+                returncode = 1
+            with open(os.path.join(running, 'returncode'), 'w') as f:
+                f.write(str(returncode))
+            os.rename(running, os.path.join(root, 'done', key))
+        finally:
+            free += n
+
+    async def loop():
+        nonlocal free
+        tasks = set()
+        while True:
+            pending = sorted(k for k in os.listdir(os.path.join(root, 'pending'))
+                             if not k.startswith('.'))
+            for key in pending:
+                found = spec(key)
+                if found is None:
+                    continue
+                n = min(found['np'], cores)
+                if n > free:
+                    break
+                free -= n
+                tasks.add(asyncio.ensure_future(claim(key, found, n)))
+            tasks = {t for t in tasks if not t.done()}
+            if once and not pending and not tasks:
+                return
+            await asyncio.sleep(poll)
+
+    asyncio.run(loop())
+
+
+class Dispatcher:
+    """ Spread jobs over backends, each with its own core budget
+
+    A job goes to the first backend (in the given order) with job.np free
+    cores and waits while none has them, so a Local backend listed first
+    is filled before remote hosts are used.
+    """
+    def __init__(self, *backends):
+        self.backends = list(backends)
+        self._free = [b.cores for b in backends]
+        self._cond = None
+        self._loop = None
+
+    def _condition(self) -> asyncio.Condition:
+        # as in runner.Scheduler: one Condition and core budget per loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._cond = loop, asyncio.Condition()
+            self._free = [b.cores for b in self.backends]
+        return self._cond
+
+    async def _acquire(self, n:int) -> int:
+        if all(n > b.cores for b in self.backends):
+            raise ValueError('no backend has {} cores'.format(n))
+        async with self._condition():
+            fits = lambda: next((i for i, f in enumerate(self._free) if f >= n), None)
+            await self._cond.wait_for(lambda: fits() is not None)
+            i = fits()
+            self._free[i] -= n
+            return i
+
+    async def _release(self, i:int, n:int):
+        async with self._condition():
+            self._free[i] += n
+            self._cond.notify_all()
+
+    async def _run(self, job:Job) -> Result:
+        i = await self._acquire(job.np)
+        start = time.time()
+        try:
+            returncode = await self.backends[i].execute(job)
+        finally:
+            await self._release(i, job.np)
+        result = Result(job, returncode, time.time() - start)
+        result.backend = self.backends[i].name
+        return result
+
+    def submit(self, job:Job, callback=None) -> asyncio.Future:
+        future = asyncio.ensure_future(self._run(job))
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    async def gather(self, jobs, callback=None) -> list:
+        return await asyncio.gather(*[self.submit(j, callback) for j in jobs])
+
+    def run(self, jobs, callback=None) -> list:
+        """ Blocking helper: run all jobs and return their Results in order """
+        return asyncio.run(self.gather(jobs, callback))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue worker for dispatch.Queue')
+    parser.add_argument('mode', choices=['worker'])
+    parser.add_argument('root')
+    parser.add_argument('--cores', type=int, default=os.cpu_count())
+    parser.add_argument('--executable', default=PHITS)
+    parser.add_argument('--mpirun', default='mpirun')
+    parser.add_argument('--dummy', action='store_true',
+                        help='run dummy_phits.py without mpirun')
+    parser.add_argument('--poll', type=float, default=2.)
+    parser.add_argument('--once', action='store_true')
+    args = parser.parse_args()
+    executable, mpirun = args.executable, args.mpirun
+    if args.dummy:
+        executable, mpirun = runner.DUMMY, None
+    serve(args.root, args.cores, executable, mpirun, args.poll, args.once,
+          echo=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Stand-in for the PHITS executable, for trying the runners offline
+
+Reads maxcas/maxbch from phits.in in the working directory, prints one
+progress line per batch and writes a phits.out with the end-of-job
+summary tables.  DUMMY_PHITS_DELAY sets the seconds spent per batch.
+"""
+
+import os
+import re
+import sys
+import time
+
+
+def main():
+    deck = open('phits.in').read() if os.path.exists('phits.in') else ''
+    maxcas = re.search(r'maxcas\s*=\s*(\d+)', deck)
+    maxbch = re.search(r'maxbch\s*=\s*(\d+)', deck)
+    maxcas = int(maxcas.group(1)) if maxcas else 10
+    maxbch = int(maxbch.group(1)) if maxbch else 10
+    delay = float(os.environ.get('DUMMY_PHITS_DELAY', '0.01'))
+    start = time.time()
+    for bat in range(1, maxbch + 1):
+        time.sleep(delay)
+        print(' bat[{:8d}] ncas = {:15d}. : cpu time = {:9.3f} s.'.format(
+                bat, bat * maxcas, time.time() - start), flush=True)
+    line = ' ' + '-' * 79 + '\n'
+    title = '{:<20}{:>10}{:>17}{:>25}\n'
+    histories = maxcas * maxbch
+    with open('phits.out', 'w') as f:
+        for table, rows in (('prod. particles', [('neutron', 0.8), ('photon', 0.3)]),
+                            ('leak. particles', [('proton', 0.9), ('neutron', 0.6)])):
+            f.write(line + title.format(
+                    ' ' + table, 'number', 'weight', 'weight per source') + line)
+            for name, fraction in rows:
+                n = int(fraction * histories)
+                f.write('     {:<12}{:>12}    {:.7E}    {:.7E}\n'.format(
+                        name, n, float(n), n / histories))
+        f.write(line + ' source: maxcas    maxbch      irskip   average weight'
+                '          total source\n' + line)
+        f.write('{:12d}{:12d}{:12d}    {:.7E}    {:.13E}\n\n'.format(
+                maxcas, maxbch, 0, 1.0, float(histories)))
+        f.write(line + ' CPU time and number of event called in PHITS\n' + line)
+        f.write('\n                             sec\n'
+                ' total cpu time = {:14.2f}\n'.format(time.time() - start))
+    print('dummy phits finished', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
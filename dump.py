@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Read and write PHITS particle dump files (dump = N in a tally) """
+
+import os
+from os.path import exists
+from itertools import islice
+import numpy as np
+
+# PHITS dump column codes
+CODES = {
+        1: 'kf', 2: 'x', 3: 'y', 4: 'z', 5: 'u', 6: 'v', 7: 'w', 8: 'e',
+        9: 'wt', 10: 'tm', 11: 'c1', 12: 'c2', 13: 'c3', 14: 'sx', 15: 'sy',
+        16: 'sz', 17: 'name', 18: 'nocas', 19: 'nobch', 20: 'no',
+        }
+NAMES = {name: code for code, name in CODES.items()}
+DEFAULT = (1, 2, 3, 4, 5, 6, 7, 8, 9)
+
+
+def _names(columns) -> list:
+    return [c if isinstance(c, str) else CODES[c] for c in columns]
+
+
+def record_dtype(columns=DEFAULT, marker:int=4) -> np.dtype:
+    """ One Fortran unformatted record: length marker, float64 per column,
+    length marker; marker=0 gives the bare columns """
+    fields = [(n, '<f8') for n in _names(columns)]
+    if marker:
+        kind = '<i{}'.format(marker)
+        fields = [('head', kind)] + fields + [('tail', kind)]
+    return np.dtype(fields)
+
+
+class DumpFile:
+    """ Particle records of a dump file, mapped rather than loaded
+
+    columns lists the dump codes (or names) given after dump = N in the
+    tally, in order.  A binary dump (dump = N > 0) is a Fortran sequential
+    file with one record per particle; it is memory-mapped with a
+    structured dtype including the record markers (marker bytes each, 4
+    for most compilers), so ``records`` can be sliced like an array of
+    tens of GB.  An ASCII dump (dump = -N) is streamed in chunks.
+
+    chunks() yields plain structured arrays of the columns; select() and
+    histogram() work chunk by chunk with vectorized masks, where being a
+    callable chunk -> bool mask or a dict of column: value or (lo, hi).
+    """
+    def __init__(self, filename:str, columns=DEFAULT, binary:bool=None,
+                 marker:int=4):
+        assert exists(filename), 'Dump file not found'
+        self.filename = filename
+        self.columns = _names(columns)
+        self.marker = marker
+        self.dtype = record_dtype(columns, 0)
+        self.binary = self._binary() if binary is None else binary
+        self.records = None
+        if self.binary:
+            rtype = record_dtype(columns, marker)
+            size = os.path.getsize(filename)
+            if size % rtype.itemsize:
+                raise ValueError('{} is not a whole number of {}-column '
+                                 'records'.format(filename, len(self.columns)))
+            self.records = np.memmap(filename, dtype=rtype, mode='r')
+            if len(self.records) and not self._markers(self.records[:1]):
+                raise ValueError('record markers of {} do not match {} '
+                                 'columns'.format(filename, len(self.columns)))
+
+    def _binary(self) -> bool:
+        with open(self.filename, 'rb') as f:
+            head = f.read(self.marker)
+        expected = 8 * len(self.columns)
+        return len(head) == self.marker and \
+               int.from_bytes(head, 'little') == expected
+
+    def _markers(self, records) -> bool:
+        n = 8 * len(self.columns)
+        return bool(np.all(records['head'] == n) and np.all(records['tail'] == n))
+
+    def check(self, size:int=1 << 20) -> bool:
+        """ True if every record marker of a binary dump is intact """
+        return all(self._markers(self.records[i:i + size])
+                   for i in range(0, len(self.records), size))
+
+    def __len__(self):
+        if self.binary:
+            return len(self.records)
+        with open(self.filename, 'rb') as f:
+            return sum(1 for line in f if line.strip())
+
+    def _blocks(self, size:int):
+        """ Record views (memmap slices with markers for binary dumps) """
+        if self.binary:
+            for i in range(0, len(self.records), size):
+                yield self.records[i:i + size]
+            return
+        ncols = len(self.columns)
+        with open(self.filename, 'r') as f:
+            while True:
+                lines = list(islice(f, size))
+                if not lines:
+                    return
+                values = np.fromstring(''.join(lines), dtype=float, sep=' ')
+                yield values.reshape(-1, ncols).view(self.dtype).ravel()
+
+    def _pack(self, block) -> np.ndarray:
+        if block.dtype == self.dtype:
+            return block
+        out = np.empty(len(block), dtype=self.dtype)
+        for name in self.columns:
+            out[name] = block[name]
+        return out
+
+    def chunks(self, size:int=1 << 20):
+        """ Structured arrays of at most size records, in file order """
+        for block in self._blocks(size):
+            yield self._pack(block)
+
+    def select(self, where=None, size:int=1 << 20) -> np.ndarray:
+        """ All records passing where, as one structured array """
+        parts = [self._pack(b[_mask(b, where)]) for b in self._blocks(size)]
+        return np.concatenate(parts) if parts else np.empty(0, self.dtype)
+
+    def histogram(self, fields, bins, weights='wt', where=None,
+                  range=None, size:int=1 << 20):
+        """ Weighted histogram of one column or several (a tuple) over the
+        whole file; bins are edges, or counts over range (by default the
+        extent of the selected records, found in a first pass).
+        Returns (hist, edges) as np.histogramdd does """
+        if isinstance(fields, str):
+            fields, bins = (fields,), [bins]
+            range = None if range is None else [range]
+        per_field = bins if isinstance(bins, (list, tuple, np.ndarray)) \
+                    else [bins] * len(fields)
+        counts = [np.ndim(b) == 0 for b in per_field]
+        if any(counts) and (range is None or None in range):
+            # edges from counts need the extent of the whole file, not of
+            # the first chunk, or later chunks fall outside them
+            range = self._range(fields, counts, range, where, size)
+        hist, edges = None, None
+        for block in self._blocks(size):
+            if where is not None:
+                block = block[_mask(block, where)]
+            sample = np.stack([block[f] for f in fields], axis=1)
+            w = block[weights] if weights else None
+            if hist is None:
+                hist, edges = np.histogramdd(
+                        sample, bins=bins, range=range, weights=w)
+            else:
+                hist += np.histogramdd(sample, bins=edges, weights=w)[0]
+        if hist is None:
+            hist, edges = np.histogramdd(
+                    np.empty((0, len(fields))), bins=bins, range=range)
+        return (hist, edges[0]) if len(fields) == 1 else (hist, edges)
+
+    def _range(self, fields, counts, range, where, size) -> list:
+        """ range completed by a min/max pass for the fields binned by counts """
+        range = list(range or [None] * len(fields))
+        todo = [i for i, c in enumerate(counts) if c and range[i] is None]
+        lo = np.full(len(todo), np.inf)
+        hi = np.full(len(todo), -np.inf)
+        for block in self._blocks(size):
+            if where is not None:
+                block = block[_mask(block, where)]
+            if len(block):
+                lo = np.minimum(lo, [block[fields[i]].min() for i in todo])
+                hi = np.maximum(hi, [block[fields[i]].max() for i in todo])
+        for j, i in enumerate(todo):
+            # an empty selection keeps numpy's default range
+            range[i] = (lo[j], hi[j]) if lo[j] <= hi[j] else (0., 1.)
+        return range
+
+
+def _mask(chunk:np.ndarray, where) -> np.ndarray:
+    if where is None:
+        return np.ones(len(chunk), dtype=bool)
+    if callable(where):
+        return np.asarray(where(chunk), dtype=bool)
+    mask = np.ones(len(chunk), dtype=bool)
+    for name, condition in where.items():
+        column = chunk[name]
+        if isinstance(condition, tuple):
+            lo, hi = condition
+            if lo is not None:
+                mask &= column >= lo
+            if hi is not None:
+                mask &= column < hi
+        else:
+            mask &= np.isin(column, condition)
+    return mask
+
+
+def write(filename:str, records, columns=None, binary:bool=True,
+          marker:int=4, size:int=1 << 20) -> list:
+    """ Write records (a structured array, or an iterable of them such as
+    DumpFile.chunks()) as a dump PHITS can read back with s-type = 17.
+    Returns the column codes to give after dump = N in the source. """
+    if isinstance(records, np.ndarray):
+        records = [records[i:i + size] for i in range(0, len(records), size)]
+    codes = None
+    with open(filename, 'wb' if binary else 'w') as f:
+        for chunk in records:
+            if codes is None:
+                names = list(columns or chunk.dtype.names)
+                codes = [NAMES[n] if isinstance(n, str) else n for n in names]
+                names = _names(codes)
+                rtype = record_dtype(codes, marker if binary else 0)
+            out = np.empty(len(chunk), dtype=rtype)
+            for name in names:
+                out[name] = chunk[name]
+            if binary:
+                if marker:
+                    out['head'] = out['tail'] = 8 * len(names)
+                out.tofile(f)
+            else:
+                np.savetxt(f, out.view('<f8').reshape(-1, len(names)),
+                           fmt='%.15E')
+    return codes or []
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Append-only journal of sweep job states, for resuming after a crash """
+
+import os
+import json
+import time
+
+STATES = ('queued', 'running', 'done', 'failed')
+
+
+class Journal:
+    """ JSON-lines log of (key, state, data) records
+
+    Every record is appended with a single write and fsynced before the
+    call returns, so after a crash the log holds every transition up to
+    the last one, at worst followed by a torn line that is skipped on
+    reading.  The latest record of each key is its state.  call() wraps
+    one job: a key already done returns its stored result without running
+    anything, which lets a deterministic sweep replay itself up to the
+    point where it stopped.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            self._load()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # terminate a torn last line so the next record starts clean
+        if os.path.getsize(path):
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    os.write(self._fd, b'\n')
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.jobs[record['key']] = record
+
+    def record(self, key:str, state:str, **data) -> dict:
+        if state not in STATES:
+            raise ValueError("state must be one of {}".format(STATES))
+        record = dict(key=key, state=state, time=time.time(), **data)
+        os.write(self._fd, (json.dumps(record) + '\n').encode())
+        os.fsync(self._fd)
+        self.jobs[key] = record
+        return record
+
+    def state(self, key:str) -> str:
+        record = self.jobs.get(key)
+        return record['state'] if record else None
+
+    def result(self, key:str):
+        return self.jobs[key].get('result')
+
+    def pending(self, keys) -> list:
+        """ keys not done yet; queued / running / failed ones run again """
+        return [k for k in keys if self.state(k) != 'done']
+
+    def queue(self, keys):
+        for key in self.pending(keys):
+            if self.state(key) is None:
+                self.record(key, 'queued')
+
+    def call(self, key:str, function, *args, **kwargs):
+        """ function(*args, **kwargs) journaled under key; its result must
+        be JSON serialisable (tuples come back as lists) """
+        if self.state(key) == 'done':
+            return self.result(key)
+        self.record(key, 'running')
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            self.record(key, 'failed', error=repr(error))
+            raise
+        self.record(key, 'done', result=result)
+        return result
+
+    def compact(self):
+        """ Rewrite the log with only the latest record per key """
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for record in self.jobs.values():
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def close(self):
+        os.close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
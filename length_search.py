@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Search for the target length at which a run stops passing a criterion """
+
+import math
+import numpy as np
+
+
+class LengthSearch:
+    """ Find the first length on the grid start + k*step that fails
+
+    evaluate(length) runs one simulation and returns (passed, value), value
+    being the attenuated quantity the criterion compares with threshold
+    (e.g. neutron current * area), or None if there is none.  Passing is
+    assumed monotone in length: the search brackets the boundary with
+    exponentially growing strides, then narrows it by bisection.  When a
+    threshold is given, an exponential attenuation model fitted to the
+    values seen so far proposes the next length on every other probe.
+    Every length is simulated at most once; ``history`` records them all.
+    """
+    def __init__(self, evaluate, start:float=5.0, step:float=5.0,
+                 threshold:float=None, maxlength:float=None):
+        self.evaluate = evaluate
+        self.start = start
+        self.step = step
+        self.threshold = threshold
+        self.maxlength = maxlength
+        self.history = {}
+
+    def length(self, k:int) -> float:
+        return self.start + k * self.step
+
+    def _probe(self, k:int) -> bool:
+        length = self.length(k)
+        if length not in self.history:
+            self.history[length] = self.evaluate(length)
+        return self.history[length][0]
+
+    def _predict(self):
+        """ Grid index where the fitted attenuation crosses threshold """
+        if self.threshold is None:
+            return None
+        points = [(l, v) for l, (_, v) in self.history.items()
+                  if v is not None and v > 0]
+        if len(points) < 2:
+            return None
+        x, y = np.array(points).T
+        slope, intercept = np.polyfit(x, np.log(y), 1)
+        if slope >= 0:
+            return None
+        crossing = (math.log(self.threshold) - intercept) / slope
+        return math.ceil((crossing - self.start) / self.step)
+
+    def run(self) -> float:
+        """ First failing length (start if start already fails) """
+        kmax = None
+        if self.maxlength is not None:
+            kmax = int((self.maxlength - self.start) // self.step)
+        if not self._probe(0):
+            return self.start
+        lo, hi, stride, model = 0, None, 1, True
+        while hi is None:
+            k = lo + stride
+            guess = self._predict() if model else None
+            if guess is not None:
+                # never shorter than the stride: a fit that under-predicts
+                # the crossing must not fall back to single steps
+                k = min(max(guess, lo + stride), lo + 4 * stride)
+            model = not model
+            if kmax is not None and k > kmax:
+                if lo == kmax:
+                    return self.length(kmax)
+                k = kmax
+            if self._probe(k):
+                lo, stride = k, stride * 2
+            else:
+                hi = k
+        while hi - lo > 1:
+            k = (lo + hi) // 2
+            guess = self._predict() if model else None
+            if guess is not None:
+                k = min(max(guess, lo + 1), hi - 1)
+            model = not model
+            if self._probe(k):
+                lo = k
+            else:
+                hi = k
+        return self.length(hi)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Follow running PHITS jobs by tailing their output files """
+
+import os
+import re
+import glob
+import json
+import time
+import asyncio
+
+_BATCH = re.compile(
+        rb'bat\[\s*(\d+)\s*\]\s*ncas\s*=\s*([\d.Ee+]+)\s*:\s*'
+        rb'cpu time\s*=\s*([\d.Ee+]+)')
+_DECK = re.compile(r'^\s*(maxcas|maxbch)\s*=\s*([\d.Ee+]+)', re.M)
+
+
+class Tail:
+    """ Complete lines appended to a file since the last read
+
+    Only the bytes past the last offset are read.  A file that shrank was
+    rewritten (PHITS rewrites tally files every batch) and is read again
+    from the start; rewound tells the caller it happened.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.offset = 0
+        self.rewound = False
+        self._partial = b''
+
+    def read(self) -> list:
+        self.rewound = False
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:
+            self.offset, self._partial, self.rewound = 0, b'', True
+        if size == self.offset:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        return lines
+
+
+class TallyProgress:
+    """ Size and number of pages written so far of one tally file """
+    def __init__(self, path:str):
+        self.tail = Tail(path)
+        self.pages = 0
+
+    def poll(self) -> dict:
+        lines = self.tail.read()
+        if self.tail.rewound:
+            self.pages = 0
+        self.pages += sum(1 for line in lines if b'newpage:' in line)
+        return {'bytes': self.tail.offset, 'pages': self.pages}
+
+
+class Progress:
+    """ Batch progress, histories/s and ETA of one job directory
+
+    The batch lines PHITS prints to stdout (captured in stdout.txt by
+    runner) and to phits.out are tailed incrementally; tally files
+    (*.out) are followed for size and pages.  The target number of
+    histories is maxcas*maxbch from the deck unless total is given.
+    Files last modified before since (default: when the Progress was
+    created) are left over from an earlier run and ignored.  poll() returns a JSON-ready status
+    dict.
+    """
+    def __init__(self, workdir:str, name:str=None, total:int=None,
+                 deckname:str='phits.in', window:int=8, since:float=None):
+        self.workdir = workdir
+        self.name = name or os.path.basename(os.path.normpath(workdir))
+        self.deck = os.path.join(workdir, deckname)
+        self.total = total
+        self.window = window
+        self.logs = [Tail(os.path.join(workdir, f))
+                     for f in ('stdout.txt', 'phits.out')]
+        self.tallies = {}
+        self.batch = 0
+        self.histories = 0
+        self.cpu = 0.
+        self.finished = False
+        self.started = time.time()
+        self.since = self.started if since is None else since
+        self._samples = []   # (wall time, histories) when histories grew
+
+    def _total(self):
+        if self.total is None and os.path.exists(self.deck):
+            with open(self.deck) as f:
+                found = dict(_DECK.findall(f.read()))
+            if len(found) == 2:
+                self.total = int(float(found['maxcas']) * float(found['maxbch']))
+        return self.total
+
+    def _fresh(self, path:str) -> bool:
+        try:
+            return os.path.getmtime(path) >= self.since - 1.
+        except OSError:
+            return False
+
+    def _logs(self):
+        histories = self.histories
+        for tail in self.logs:
+            if not self._fresh(tail.path):
+                continue
+            for line in tail.read():
+                match = _BATCH.search(line)
+                if match:
+                    batch, ncas, cpu = match.groups()
+                    if float(ncas) >= self.histories:
+                        self.batch = int(batch)
+                        self.histories = int(float(ncas))
+                        self.cpu = float(cpu)
+                elif b'total cpu time' in line:
+                    self.finished = True
+        if self.histories > histories:
+            self._samples.append((time.time(), self.histories))
+            del self._samples[:-self.window]
+
+    def _tallies(self) -> dict:
+        for path in glob.glob(os.path.join(self.workdir, '*.out')):
+            name = os.path.basename(path)
+            if name != 'phits.out' and name not in self.tallies \
+                    and self._fresh(path):
+                self.tallies[name] = TallyProgress(path)
+        return {name: t.poll() for name, t in sorted(self.tallies.items())}
+
+    def rate(self) -> float:
+        """ histories/s over the last window samples, else over CPU time """
+        if len(self._samples) > 1:
+            (t0, h0), (t1, h1) = self._samples[0], self._samples[-1]
+            if t1 > t0:
+                return (h1 - h0) / (t1 - t0)
+        if self.cpu > 0:
+            return self.histories / self.cpu
+        return None
+
+    def poll(self) -> dict:
+        self._logs()
+        total, rate = self._total(), self.rate()
+        eta = None
+        if self.finished:
+            eta = 0.
+        elif total and rate:
+            eta = max(total - self.histories, 0) / rate
+        return {
+                'name': self.name,
+                'workdir': self.workdir,
+                'batch': self.batch,
+                'histories': self.histories,
+                'total': total,
+                'fraction': self.histories / total if total else None,
+                'cpu': self.cpu,
+                'elapsed': time.time() - self.started,
+                'rate': rate,
+                'eta': eta,
+                'finished': self.finished,
+                'tallies': self._tallies(),
+                }
+
+    def dump(self, path:str=None) -> dict:
+        """ poll() and write it atomically to path (workdir/progress.json) """
+        status = self.poll()
+        path = path or os.path.join(self.workdir, 'progress.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(status, f, indent=1)
+        os.replace(path + '.tmp', path)
+        return status
+
+    async def follow(self, interval:float=5., callback=None, dump:bool=False):
+        """ poll every interval seconds until cancelled, passing each
+        status to callback(status) """
+        while True:
+            status = self.dump() if dump else self.poll()
+            if callback is not None:
+                callback(status)
+            await asyncio.sleep(interval)
+
+
+def watch(workdirs, interval:float=5., callback=None, count:int=None):
+    """ Blocking loop polling several job directories, e.g. from a login
+    node; callback(statuses) defaults to printing one line per job """
+    jobs = [Progress(w, since=0.) for w in workdirs]
+    callback = callback or _print
+    n = 0
+    while count is None or n < count:
+        statuses = [j.poll() for j in jobs]
+        callback(statuses)
+        if all(s['finished'] for s in statuses):
+            return statuses
+        n += 1
+        time.sleep(interval)
+    return statuses
+
+
+def _print(statuses):
+    for s in statuses:
+        print('{:<20} batch {:>6} {:>12}/{:<12} {:>10} hist/s  eta {}'.format(
+                s['name'], s['batch'], s['histories'], s['total'] or '?',
+                '{:.0f}'.format(s['rate']) if s['rate'] else '?',
+                'done' if s['finished'] else (
+                    '{:.0f}s'.format(s['eta']) if s['eta'] is not None else '?')))
+
+
+if __name__ == '__main__':
+    import sys
+    watch(sys.argv[1:] or ['.'])
@@ -2,10 +2,17 @@
 #!/usr/bin/python3
 """ Read output files """
 
+import os
 import re
+import copy
+import glob
+import json
+import mmap
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-from io import StringIO
 from os.path import exists
+from collections import OrderedDict
 import numpy as np
 
 
@@ -24,177 +31,1034 @@ class Phits:
     def __init__(self, filename:str):
         assert exists(filename), 'Phits output file not found'
         self.filename = filename
-        with open(filename, 'r') as f:
-            content = f.read()
-        
-        template = r'prod. particles.+?\n-+?\n([a-zA-Z0-9\-\+\.\s]+?)\s+?-'
-        string = re.findall(template, content)[0]
-        self.prod = pd.read_csv(
-            StringIO(string), 
-            delim_whitespace=True, lineterminator='\n', header=None,
-            names=['name', 'number', 'weight', 'weight_per_source']
-            )
-        
-        template = r'leak. particles.+?\n.+?\n([a-zA-Z0-9\-\+\.\s]+?)\s+?-'
-        string = re.findall(template, content)[0]
-        self.leak = pd.read_csv(
-            StringIO(string), 
-            delim_whitespace=True, lineterminator='\n', header=None,
-            names=['name', 'number', 'weight', 'weight_per_source']
-            )
+        summary = Summary(filename)
+        assert summary.prod is not None, 'prod. particles table not found'
+        assert summary.leak is not None, 'leak. particles table not found'
+        self.summary = summary
+        self.prod = pd.DataFrame(summary.prod)
+        self.leak = pd.DataFrame(summary.leak)
 
-# T-cross reader (output forward current)
-class ForwardCurrent:
-    def __init__(self, filename:str):
-        assert exists(filename), 'ForwardCurrent output file not found'
+
+# end-of-job summary of phits.out, read from the tail of the file
+_PARTICLES = np.dtype([
+        ('name', 'U16'), ('number', 'i8'),
+        ('weight', 'f8'), ('weight_per_source', 'f8'),
+        ])
+_TABLES = {
+        'prod. particles': 'prod',
+        'particle decays': 'decay',
+        'stopped particles': 'stopped',
+        'leak. particles': 'leak',
+        }
+_CPU = re.compile(r'total cpu time\s*=\s*(\S+)')
+
+
+class Summary(Field):
+    """ Particle tables, source and CPU time from the end of phits.out
+
+    Only the tail of the file is read, doubling from `tail` bytes until the
+    prod. particles table is in it (or `limit` / the whole file is reached),
+    so the cost does not depend on how verbose the log is.
+    Tables are structured arrays with fields name, number, weight and
+    weight_per_source; missing blocks stay None.
+    """
+    def __init__(self, filename:str, tail:int=1 << 16, limit:int=None):
+        assert exists(filename), 'Phits output file not found'
+        self.filename = filename
+        self.prod = self.decay = self.stopped = self.leak = None
+        self.maxcas = self.maxbch = self.irskip = None
+        self.weight = self.histories = self.cpu = None
+        self._parse(self._tail(filename, tail, limit))
+
+    @property
+    def complete(self) -> bool:
+        """ True once PHITS has written its final CPU time """
+        return self.cpu is not None
+
+    @staticmethod
+    def _tail(filename:str, tail:int, limit:int=None) -> str:
+        size = os.path.getsize(filename)
+        limit = size if limit is None else min(limit, size)
+        found = False
+        with open(filename, 'rb') as f:
+            while True:
+                tail = min(tail, limit)
+                f.seek(size - tail)
+                data = f.read(tail)
+                # one more doubling once the marker is in, so the blocks
+                # printed just before it are read as well
+                if found or tail >= limit:
+                    break
+                found = b'prod. particles' in data
+                tail *= 2
+        return data.decode('ascii', 'replace')
+
+    def _parse(self, text:str):
+        table, rows, open_ = None, [], False
+        lines = iter(text.splitlines())
+        for line in lines:
+            stripped = line.strip()
+            if table is not None:
+                if stripped.startswith('-'):
+                    if open_:
+                        setattr(self, table, np.array(rows, dtype=_PARTICLES))
+                        table = None
+                    open_ = True
+                elif stripped:
+                    name, number, weight, per_source = stripped.rsplit(None, 3)
+                    rows.append((name, int(float(number)),
+                                 float(weight), float(per_source)))
+                continue
+            for title, attr in _TABLES.items():
+                if stripped.startswith(title):
+                    table, rows, open_ = attr, [], False
+                    break
+            else:
+                if stripped.startswith('source:') and 'maxcas' in stripped:
+                    self._source(lines)
+                elif stripped.startswith('total cpu time'):
+                    self.cpu = float(_CPU.search(stripped).group(1))
+        if table is not None and open_:
+            setattr(self, table, np.array(rows, dtype=_PARTICLES))
+
+    def _source(self, lines):
+        """ maxcas maxbch irskip average-weight total-source row """
+        for line in lines:
+            values = line.split()
+            if values and not line.strip().startswith('-'):
+                self.maxcas, self.maxbch, self.irskip = (
+                        int(float(v)) for v in values[:3])
+                self.weight, self.histories = (float(v) for v in values[3:5])
+                return
+
+
+# streaming tokenizer for ANGEL-format tally files
+_PAIR = re.compile(r'([\w.\-]+)\s*=\s*(\S+)')
+_RANGE = re.compile(
+        r'y\s*=(.+?)to(.+?)by(.+?);\s*'
+        r'x\s*=(.+?)to(.+?)by(.+?);'
+        )
+
+
+def _number(value:str):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _is_data(line:str) -> bool:
+    head = line[:2]
+    return head[:1].isdigit() or (
+            head[:1] in '+-.' and head[1:2] in '0123456789.')
+
+
+class Block:
+    """ Contiguous run of numeric lines opened by h:, hc: or a column header """
+    def __init__(self, label=None, columns=None):
+        self.label = label
+        self.columns = columns or []
+        self.lines = []
+        self.start = None   # line number of the first data line
+
+    def text(self) -> str:
+        return ''.join(self.lines)
+
+
+class Page(Field):
+    """ One newpage: of an ANGEL file: header pairs, data blocks, summary """
+    def __init__(self, number:int):
+        self.number = number
+        self.meta = {}
+        self.blocks = []
+        self.summary = {}
+        self.title = None
+
+
+class PageStream:
+    """ Single pass over an ANGEL file yielding one Page at a time
+
+    The file is walked line by line as a small state machine, so only the
+    page being assembled is held in memory.  Input-echo lines found before
+    the first newpage: are collected into ``header``.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.header = {}
+
+    def __iter__(self):
+        if isinstance(self.source, str):
+            with open(self.source, 'r') as f:
+                yield from self._tokenize(f)
+        else:
+            yield from self._tokenize(self.source)
+
+    def _tokenize(self, lines):
+        page, block, columns = None, None, None
+        summary = done = False
+        for n, raw in enumerate(lines):
+            line = raw.strip()
+            if not line:
+                continue
+            if line.startswith('newpage:'):
+                if page is not None:
+                    yield page
+                page = Page(0)
+                block, columns = None, None
+                summary = done = False
+                continue
+            if page is None:
+                if not line.startswith('#') and '=' in line:
+                    key, _, value = line.partition('#')[0].partition('=')
+                    self.header[key.strip()] = value.strip()
+                continue
+            if done:
+                continue
+            if _is_data(line):
+                if block is None and columns is not None:
+                    block = Block(columns=columns)
+                    page.blocks.append(block)
+                    columns = None
+                if block is not None:
+                    if not block.lines:
+                        block.start = n
+                    block.lines.append(raw)
+                continue
+            if block is not None and not block.lines and line.startswith('#'):
+                block.columns = line[1:].split()
+                continue
+            block = None
+            if line.startswith('#'):
+                pairs = _PAIR.findall(line)
+                if pairs:
+                    for key, value in pairs:
+                        page.meta.setdefault(key, value)
+                    if 'no.' in page.meta and not page.number:
+                        page.number = int(page.meta['no.'])
+                elif not page.blocks:
+                    columns = line[1:].split()
+            elif line.startswith(('hc:', 'h:')):
+                block = Block(label=line)
+                page.blocks.append(block)
+            elif line.startswith('e:'):
+                done = True
+            elif '&=&' in line:
+                key, _, value = line.partition('&=&')
+                value = value.split()
+                page.summary[key.strip().rstrip('.')] = (
+                        _number(value[0]) if value else None)
+            elif summary:
+                if page.title is None and not page.summary:
+                    page.title = line
+            elif page.blocks and 'space' in line:
+                summary = True
+        if page is not None:
+            yield page
+
+
+def _count(block:Block) -> int:
+    if not block.lines:
+        return 0
+    first = len(block.lines[0].split())
+    last = len(block.lines[-1].split())
+    return first * (len(block.lines) - 1) + last
+
+
+def _bulk(blocks, chunk:int=1 << 22):
+    """ Convert the text of data blocks into one contiguous float64 array
+
+    blocks may be a generator.  The text of each block is released as soon
+    as it is taken and converted with one np.fromstring call per `chunk`
+    characters into a buffer that doubles as it fills, so memory stays
+    close to the size of the result rather than of the text.
+    Returns the array and the (start, stop) offsets of each block in it.
+    """
+    values, size, offsets = np.empty(1 << 16), 0, []
+    texts, counts, pending = [], [], 0
+
+    def flush():
+        nonlocal values, size
+        parsed = np.fromstring(' '.join(texts), dtype=float, sep=' ')
+        sizes = counts
+        if parsed.size != sum(counts):
+            # ragged rows: fall back to one conversion per block
+            parts = [np.fromstring(t, dtype=float, sep=' ') for t in texts]
+            sizes = [p.size for p in parts]
+            parsed = np.concatenate(parts)
+        if size + parsed.size > values.size:
+            grown = np.empty(max(2 * values.size, size + parsed.size))
+            grown[:size] = values[:size]
+            values = grown
+        values[size:size + parsed.size] = parsed
+        for n in sizes:
+            offsets.append((size, size + n))
+            size += n
+        texts.clear()
+        counts.clear()
+
+    for b in blocks:
+        texts.append(b.text())
+        counts.append(_count(b))
+        pending += len(texts[-1])
+        b.lines = []
+        if pending >= chunk:
+            flush()
+            pending = 0
+    if texts:
+        flush()
+    values.resize(size, refcheck=False)
+    return values, offsets
+
+
+def _select(pages, label:str=''):
+    """ Bulk-convert the first data block of each page
+
+    Only blocks whose marker line starts with label are considered.
+    Returns (page, ncols, values) for every page that has such a block,
+    values being a view into one array shared by all pages.  Pages are
+    converted as they arrive, so a PageStream is never held in full.
+    """
+    found_pages, ncols = [], []
+
+    def blocks():
+        for p in pages:
+            found = [b for b in p.blocks if (b.label or '').startswith(label)]
+            if found and found[0].lines:
+                p.blocks = found[:1]
+                found_pages.append(p)
+                ncols.append(len(found[0].lines[0].split()))
+                yield found[0]
+
+    values, offsets = _bulk(blocks())
+    return [(p, n, values[a:b])
+            for p, n, (a, b) in zip(found_pages, ncols, offsets)]
+
+
+def _load(filename:str, label:str='', cache=None):
+    """ (header, items) of filename, see PageStream and _select """
+    if cache is not None:
+        # keyed before parsing: a file rewritten meanwhile (e.g. by a
+        # running PHITS) is then stored under its old key and not reused
+        key = cache.key(filename, label)
+        loaded = cache.load(filename, label, key)
+        if loaded is not None:
+            return loaded
+    stream = PageStream(filename)
+    items = _select(stream, label)
+    if cache is not None:
+        cache.save(filename, label, stream.header, items, key)
+    return stream.header, items
+
+
+def _fingerprint(filename:str, chunk:int=1 << 20) -> str:
+    # sample head and tail only, size and mtime catch the rest
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        h.update(f.read(chunk))
+        f.seek(max(0, os.fstat(f.fileno()).st_size - chunk))
+        h.update(f.read(chunk))
+    return h.hexdigest()
+
+
+class ParseCache:
+    """ Binary npz store of parsed tally files
+
+    An entry holds the numeric array, page offsets, the input-echo header
+    and page metadata (header pairs, &=& summary, marker line, column
+    header) and is valid
+    while the size, mtime and sampled content hash of the source match.
+    Entries go next to each file (``<file>.npz``) or, when directory is
+    given, into that directory, which is trimmed to max_bytes by removing
+    the least recently used entries.
+    """
+    version = 2
+
+    def __init__(self, directory:str=None, max_bytes:int=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, filename:str, label:str='') -> str:
+        suffix = '.' + label.rstrip(':') if label else ''
+        if self.directory is None:
+            return filename + suffix + '.npz'
+        name = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+        return os.path.join(self.directory, name + suffix + '.npz')
+
+    def key(self, filename:str, label:str='') -> dict:
+        st = os.stat(filename)
+        return {'version': self.version, 'label': label,
+                'size': st.st_size, 'mtime': st.st_mtime_ns,
+                'hash': _fingerprint(filename)}
+
+    def load(self, filename:str, label:str='', key:dict=None):
+        path = self.path(filename, label)
+        if not exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if json.loads(str(data['key'])) != (
+                        key or self.key(filename, label)):
+                    return None
+                values = data['values']
+                offsets = data['offsets']
+                ncols = data['ncols']
+                pages = json.loads(str(data['pages']))
+                header = json.loads(str(data['header']))
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        items = []
+        for d, n, (a, b) in zip(pages, ncols, offsets):
+            p = Page(d['number'])
+            p.meta, p.summary, p.title = d['meta'], d['summary'], d['title']
+            p.blocks = [Block(d['label'], d['columns'])]
+            items.append((p, int(n), values[a:b]))
+        return header, items
+
+    def save(self, filename:str, label:str, header:dict, items:list,
+             key:dict=None):
+        """ Store items parsed from filename; key is the key the file had
+        when the parse started (default: its key now) """
+        path = self.path(filename, label)
+        pages = [{'number': p.number, 'meta': p.meta, 'summary': p.summary,
+                  'title': p.title, 'label': p.blocks[0].label,
+                  'columns': p.blocks[0].columns} for p, _, _ in items]
+        ncols = [n for _, n, _ in items]
+        sizes = np.cumsum([0] + [v.size for _, _, v in items])
+        offsets = np.stack([sizes[:-1], sizes[1:]], axis=1)
+        values = (np.concatenate([v for _, _, v in items]) if items
+                  else np.empty(0))
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, values=values,
+                         offsets=offsets,
+                         ncols=np.array(ncols, dtype=np.int64),
+                         pages=json.dumps(pages),
+                         header=json.dumps(header),
+                         key=json.dumps(key or self.key(filename, label)))
+            os.replace(tmp, path)
+        except OSError:
+            if exists(tmp):
+                os.remove(tmp)
+            return
+        if self.directory is not None:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+# default cache used by the readers; replace with ParseCache(directory)
+# to keep the npz files out of the run directories
+CACHE = ParseCache()
+
+
+class TallyFile:
+    """ Memory-mapped tally file decoding its pages on first access
+
+    A single scan over the mapping records the input-echo header and, for
+    every newpage:, its byte range and the key = value pairs of the '#'
+    lines that follow it.
+    Decoded pages are kept in an LRU cache of at most cache_size entries;
+    build(page, ncols, values) turns a decoded page into the cached object.
+    """
+    def __init__(self, filename:str, label:str='', cache_size:int=8,
+                 build=None):
+        assert exists(filename), 'Tally output file not found'
         self.filename = filename
-        with open(filename, 'r') as f:
-            content = f.read()
-        
-        template = (
-                r'newpage:\s+#\s+no.+?([0-9]+).+?'
-                r'e-lower.+?\n(.+?)\s+#.+?'
-                r'space.+?\n\s+(.+?)\s*\n'
-                r'\s+(\S+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\S+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\S+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\S+)\s+&=&\s+(\S+)\s+.+?\ne:'
-                )
-        strings = re.findall(template, content, re.DOTALL)
-        for p in strings:
-            pname = 'page' + p[0]
-            self.__setattr__(pname, Field())
-            self.__dict__[pname].table = pd.read_csv(
-                    StringIO(p[1]), 
-                    delim_whitespace=True, lineterminator='\n', header=None,
-                    names=['eLower', 'eUpper', 'proton', 'pErr', 'neutron', 'nErr']
-                    )
-            self.__dict__[pname].wt = Field()
-            self.__dict__[pname].wt.title = p[2]
-            self.__dict__[pname].wt.__setattr__(p[3], float(p[4]))
-            self.__dict__[pname].wt.__setattr__(p[5], float(p[6]))
-            self.__dict__[pname].wt.__setattr__(p[7], float(p[8]))
-            self.__dict__[pname].wt.__setattr__(p[9], float(p[10]))
+        self.label = label
+        self.cache_size = cache_size
+        self.build = build
+        self.header = {}
+        self.index = OrderedDict()
+        self._cache = OrderedDict()
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._scan()
+
+    def _scan(self):
+        m = self._map
+        starts = []
+        pos = m.find(b'newpage:')
+        while pos >= 0:
+            starts.append(pos)
+            pos = m.find(b'newpage:', pos + 8)
+        stream = PageStream(
+                m[:starts[0] if starts else len(m)].decode().splitlines(True))
+        for _ in stream:
+            pass
+        self.header = stream.header
+        for i, start in enumerate(starts):
+            stop = starts[i + 1] if i + 1 < len(starts) else len(m)
+            m.seek(start)
+            m.readline()
+            meta = {}
+            while m.tell() < stop:
+                line = m.readline().strip()
+                if line and not line.startswith(b'#'):
+                    break
+                for key, value in _PAIR.findall(line.decode()):
+                    meta.setdefault(key, value)
+            number = int(meta['no.']) if 'no.' in meta else i + 1
+            self.index[number] = (start, stop, meta)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, number):
+        return number in self.index
+
+    def __getitem__(self, number:int):
+        if number in self._cache:
+            self._cache.move_to_end(number)
+            return self._cache[number]
+        if number not in self.index:
+            raise KeyError('page {} not found in {}'.format(
+                    number, self.filename))
+        start, stop, _ = self.index[number]
+        lines = self._map[start:stop].decode().splitlines(True)
+        found = _select(PageStream(lines), self.label)
+        if not found:
+            item = None
+        elif self.build is None:
+            item = found[0]
+        else:
+            item = self.build(*found[0])
+        self._cache[number] = item
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return item
+
+    def close(self):
+        self._cache.clear()
+        self._map.close()
+
+
+class TablePage(Field):
+    """ Page holding a numeric array; ``table`` wraps it in a DataFrame on first access """
+    def __init__(self, values:np.ndarray, names:list):
+        self.values = values
+        self.names = names
+
+    @property
+    def table(self) -> pd.DataFrame:
+        if '_table' not in self.__dict__:
+            self._table = pd.DataFrame(self.values, columns=self.names)
+        return self._table
+
+
+def _weights(page:Page, title=True):
+    wt = Field()
+    if title:
+        wt.title = page.title
+    for key, value in page.summary.items():
+        wt.__setattr__(key, value)
+    return wt
+
+
+class _Reader:
+    """ Construction shared by the tally readers below
+
+    By default every page is decoded up front into pageN attributes, going
+    through the npz ParseCache (CACHE unless cache is a ParseCache, none if
+    cache is False).  With lazy=True the file is memory-mapped through
+    TallyFile instead and pageN is decoded on first access, at most
+    cache_size pages staying decoded.  The input echo found before the
+    first page is kept in ``header``.
+    """
+    label = ''
+
+    def __init__(self, filename:str, lazy:bool=False, cache_size:int=8,
+                 cache=True):
+        assert exists(filename), '{} output file not found'.format(
+                type(self).__name__)
+        self.filename = filename
+        self.tally = None
+        if lazy:
+            self.tally = TallyFile(filename, self.label, cache_size, self._page)
+            self.header = self.tally.header
+            return
+        if cache is True:
+            cache = CACHE
+        self.header, items = _load(filename, self.label, cache or None)
+        for p, ncols, values in items:
+            self.__setattr__('page' + str(p.number), self._page(p, ncols, values))
+
+    def __getattr__(self, name):
+        tally = self.__dict__.get('tally')
+        if tally is not None and name.startswith('page') and name[4:].isdigit():
+            number = int(name[4:])
+            if number in tally and tally[number] is not None:
+                return tally[number]
+        message = "'{}' object has no attribute '{}'".format(
+                type(self).__name__, name)
+        raise AttributeError(message)
+
+    def _page(self, p:Page, ncols:int, values:np.ndarray):
+        raise NotImplementedError
+
+
+_ALIASES = {'all': 'allpart'}
+_ERRORS = {'allpart': 'rErr'}
+
+
+def _columns(tokens:list, ncols:int) -> list:
+    """ DataFrame column names from an ANGEL column header
+
+    '#  e-lower  e-upper  proton  r.err  neutron  r.err' gives eLower,
+    eUpper, proton, pErr, neutron, nErr.  An r.err column is named after
+    the column before it, by initial when that is unambiguous.
+    """
+    names = []
+    for t in tokens:
+        if '-' in t and not t.startswith('-'):
+            head, _, tail = t.partition('-')
+            names.append(head + tail.capitalize())
+        elif t != 'r.err':
+            names.append(_ALIASES.get(t, t))
+        else:
+            names.append(None)
+    values = [n for n in names if n is not None]
+    initials = [n[0] for n in values]
+    for i, n in enumerate(names):
+        if n is not None:
+            continue
+        prev = names[i - 1] if i else 'r'
+        if prev in _ERRORS:
+            names[i] = _ERRORS[prev]
+        elif initials.count(prev[0]) == 1:
+            names[i] = prev[0] + 'Err'
+        else:
+            names[i] = prev + 'Err'
+    if len(names) != ncols:
+        names = ['c' + str(i) for i in range(ncols)]
+    return names
+
+
+# any tally whose pages hold a '#' column header followed by a table
+class Tally(_Reader):
+    """ Schema-driven tally reader
+
+    Columns come from each page's column header line, so the number and
+    order of particles in ``part`` or the quantity on ``axis`` are read
+    from the file rather than assumed.  ``axis``, ``mesh`` and ``part``
+    echo the tally parameters from the file header.
+    """
+    def __init__(self, filename:str, **kwargs):
+        _Reader.__init__(self, filename, **kwargs)
+        self.axis = self.header.get('axis')
+        self.mesh = self.header.get('mesh')
+        self.part = self.header.get('part', '').split()
+
+    def _page(self, p, ncols, values):
+        names = _columns(p.blocks[0].columns, ncols)
+        page = TablePage(values.reshape(-1, ncols), names)
+        if p.title is not None or p.summary:
+            page.wt = _weights(p)
+        return page
+
+
+# T-cross reader (output forward current)
+class ForwardCurrent(Tally):
+    pass
             
 #T-Track with axis=xz
-class TrackXZ:
-    def __init__(self, filename:str):
-        assert exists(filename), 'TrackXZ output file not found'
-        self.filename = filename
-        with open(filename, 'r') as f:
-            content = f.read()
-        
-        template = (
-                r'newpage:\s+#\s+no.+?([0-9]+).+?'
-                r'#\s+nx\s+=(.+?)nz\s+=(.+?)\n#.+?'
-                r'hc:\s+y\s+=(.+?)to(.+?)by(.+?);\s+'
-                r'x\s+=(.+?)to(.+?)by(.+?);\n'
-                r'(.+?)\n#.+?gshow.+?'
-                r'space.+?(\w+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\w+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\w+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\w+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\w+)\.*\s+&=&\s+(\S+)\s+\ne:'
-                )
-        strings = re.findall(template, content, re.DOTALL)
-        for p in strings:
-            pname = 'page' + p[0]
-            self.__setattr__(pname, Field())
-            nx, ny = int(p[2]), int(p[1])
-            self.__dict__[pname].ny   = ny
-            self.__dict__[pname].nx   = nx
-            self.__dict__[pname].ymax = float(p[3])
-            self.__dict__[pname].ymin = float(p[4])
-            self.__dict__[pname].dy   = float(p[5])
-            self.__dict__[pname].xmin = float(p[6])
-            self.__dict__[pname].xmax = float(p[7])
-            self.__dict__[pname].dx   = float(p[8])
-            self.__dict__[pname].hc = np.fromstring(
-                p[9], dtype=float, sep=' ').reshape(nx, ny)
-            self.__dict__[pname].wt = Field()
-            self.__dict__[pname].wt.__setattr__(p[10], float(p[11]))
-            self.__dict__[pname].wt.__setattr__(p[12], float(p[13]))
-            self.__dict__[pname].wt.__setattr__(p[14], float(p[15]))
-            self.__dict__[pname].wt.__setattr__(p[16], float(p[17]))
-            self.__dict__[pname].wt.__setattr__(p[18], p[19])
+class TrackXZ(_Reader):
+    label = 'hc:'
+
+    def _page(self, p, ncols, values):
+        page = Field()
+        nx, ny = int(p.meta['nz']), int(p.meta['nx'])
+        r = _RANGE.search(p.blocks[0].label).groups()
+        page.ny   = ny
+        page.nx   = nx
+        page.ymax = float(r[0])
+        page.ymin = float(r[1])
+        page.dy   = float(r[2])
+        page.xmin = float(r[3])
+        page.xmax = float(r[4])
+        page.dx   = float(r[5])
+        page.hc   = values.reshape(nx, ny)
+        page.wt   = _weights(p, title=False)
+        return page
 
 # T-cross with mesh=reg
-class CrossReg:
-    def __init__(self, filename:str):
-        assert exists(filename), 'CrossReg output file not found'
-        self.filename = filename
-        with open(filename, 'r') as f:
-            content = f.read()
-        
-        template = (
-                r'newpage:\s+#\s+no.+?([0-9]+).+?'
-                r'e-lower.+?\n(.+?)\s+#.+?'
-                r'space.+?\n\s+(.+?)\s*\n'
-                r'\s+(\S+)\s+&=&\s+(\S+)\s+.+?\ne:'
-                )
-        strings = re.findall(template, content, re.DOTALL)
-        for p in strings:
-            pname = 'page' + p[0]
-            self.__setattr__(pname, Field())
-            self.__dict__[pname].table = pd.read_csv(
-                    StringIO(p[1]), 
-                    delim_whitespace=True, lineterminator='\n', header=None,
-                    names=['eLower', 'eUpper', 'proton', 'pErr', 'neutron', 'nErr']
-                    )
-            self.__dict__[pname].wt = Field()
-            self.__dict__[pname].wt.title = p[2]
-            self.__dict__[pname].wt.__setattr__(p[3], float(p[4]))
+class CrossReg(Tally):
+    pass
 
 # T-deposit with mesh=reg
-class DepositReg:
-    def __init__(self, filename:str):
-        assert exists(filename), 'CrossReg output file not found'
-        self.filename = filename
-        with open(filename, 'r') as f:
-            content = f.read()
-        
-        template = (
-                r'newpage:\s+#\s+no.+?([0-9]+).+?'
-                r'#\s+num.+?\n(.+?)\s+#\s+sum'
-                )
-        strings = re.findall(template, content, re.DOTALL)
-        for p in strings:
-            pname = 'page' + p[0]
-            self.__setattr__(pname, Field())
-            self.__dict__[pname].table = pd.read_csv(
-                    StringIO(p[1]), 
-                    delim_whitespace=True, lineterminator='\n', header=None,
-                    names=['num', 'reg', 'volume', 'allpart', 'rErr']
-                    )
+class DepositReg(Tally):
+    pass
+
 # T-cross, output=fcurr, a-curr
-class ForwardCurrentAngle:
-    def __init__(self, filename:str):
-        assert exists(filename), 'ForwardCurrentAngle output file not found'
+class ForwardCurrentAngle(Tally):
+    pass
+
+
+# mesh=xyz / r-z tallies assembled into one array
+_DIMS = {'part': 0, 'e': 1, 'z': 2, 'y': 3, 'x': 4, 'r': 4}
+_INDEX = {'ie': 1, 'iz': 2, 'iy': 3, 'ix': 4, 'ir': 4}
+_AXIS = {'eng': 'e'}
+
+
+def _grid(header:dict, a:str):
+    """ Bin edges of axis a from the x-type/xmin/xmax/nx echo, if linear
+    (type 2) or logarithmic (type 3); None otherwise """
+    kind = header.get(a + '-type')
+    n = int(float(header.get('n' + a, 1)))
+    try:
+        lo, hi = float(header[a + 'min']), float(header[a + 'max'])
+    except (KeyError, ValueError):
+        return None
+    if kind == '2':
+        return np.linspace(lo, hi, n + 1)
+    if kind == '3':
+        return np.logspace(np.log10(lo), np.log10(hi), n + 1)
+    return None
+
+
+def _centers_to_edges(first:float, last:float, step:float) -> np.ndarray:
+    n = int(round((last - first) / step)) + 1
+    lo = min(first, last) - abs(step) / 2
+    return lo + abs(step) * np.arange(n + 1)
+
+
+class MeshTally:
+    """ All pages of a mesh=xyz or r-z tally in one (part, e, z, y, x) array
+
+    values and errors (relative, NaN where the file has none) are
+    preallocated from the nx/ny/nz/ne echo of the header and every page
+    is copied straight into its slice: an hc: contour page fills the two
+    axes named by ``axis`` (rows flipped to ascending order), a table page
+    fills its axis for every particle at once from the value/r.err
+    columns.  The remaining indices come from the ie/iz/iy/ix/ir pairs of
+    the page header, the particle from its part. summary or else from the
+    order of the pages.  For r-z meshes x is r and y has length 1.
+
+    edges maps 'e', 'z', 'y', 'x' to bin edges, from the header for
+    linear and log meshes and from the data for the others.  Contour
+    output carries no errors in the file itself; errors names the
+    companion file written with them (<name>_err<ext> by default, if it
+    exists).
+    """
+    dims = ('part', 'e', 'z', 'y', 'x')
+
+    def __init__(self, filename:str, errors:str=None, cache=True):
+        assert exists(filename), 'MeshTally output file not found'
         self.filename = filename
-        with open(filename, 'r') as f:
-            content = f.read()
-        
-        template = (
-                r'newpage:\s+#\s+no.+?([0-9]+).+?'
-                r'a-lower.+?\n(.+?)\s+#.+?'
-                r'space.+?\n\s+(.+?)\s*\n'
-                r'\s+(\S+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\S+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\S+)\s+&=&\s+(\S+)\s+.+?\n'
-                r'\s+(\S+)\s+&=&\s+(\S+)\s+.+?\ne:'
-                )
-        strings = re.findall(template, content, re.DOTALL)
-        for p in strings:
-            pname = 'page' + p[0]
-            self.__setattr__(pname, Field())
-            self.__dict__[pname].table = pd.read_csv(
-                    StringIO(p[1]), 
-                    delim_whitespace=True, lineterminator='\n', header=None,
-                    names=['aLower', 'aUpper', 'proton', 'pErr', 'neutron', 'nErr']
-                    )
-            self.__dict__[pname].wt = Field()
-            self.__dict__[pname].wt.title = p[2]
-            self.__dict__[pname].wt.__setattr__(p[3], float(p[4]))
-            self.__dict__[pname].wt.__setattr__(p[5], float(p[6]))
-            self.__dict__[pname].wt.__setattr__(p[7], float(p[8]))
-            self.__dict__[pname].wt.__setattr__(p[9], float(p[10]))
+        if cache is True:
+            cache = CACHE
+        self.header, items = _load(filename, '', cache or None)
+        self.mesh = self.header.get('mesh', 'xyz')
+        if self.mesh not in ('xyz', 'r-z'):
+            raise ValueError("mesh = {} has no spatial grid".format(self.mesh))
+        self.axis = self.header.get('axis', '')
+        self.part = self.header.get('part', 'all').split()
+        letters = 'ezyr' if self.mesh == 'r-z' else 'ezyx'
+        # sizes from the header echo, else from the page headers
+        meta = items[0][0].meta if items else {}
+        shape = [len(self.part)]
+        for a in letters:
+            n = int(float(self.header.get('n' + a, meta.get('n' + a, 1))))
+            n = max([n] + [int(p.meta['i' + a]) for p, _, _ in items
+                           if 'i' + a in p.meta])
+            shape.append(n)
+        self.edges = {d: _grid(self.header, a)
+                      for d, a in zip(self.dims[1:], letters)}
+        self.values = np.zeros(shape)
+        self.errors = np.full(shape, np.nan)
+        self._fill(self.values, self.errors, items)
+        if errors is None:
+            root, ext = os.path.splitext(filename)
+            errors = root + '_err' + ext
+            errors = errors if exists(errors) else None
+        if errors is not None:
+            _, items = _load(errors, '', cache or None)
+            self._fill(self.errors, None, items)
+
+    def _fill(self, values, errors, items):
+        seen = {}
+        for p, ncols, data in items:
+            index = [0] * 5
+            for key, dim in _INDEX.items():
+                if key in p.meta:
+                    index[dim] = int(p.meta[key]) - 1
+            label = p.blocks[0].label or ''
+            if label.startswith('hc:'):
+                key = tuple(p.meta.get(k) for k in _INDEX)
+                name = p.summary.get('part', p.meta.get('part'))
+                if name in self.part:
+                    index[0] = self.part.index(name)
+                else:
+                    index[0] = seen[key] = seen.get(key, -1) + 1
+                self._contour(values, index, label, data)
+            else:
+                self._table(values, errors, index, ncols, data)
+
+    def _contour(self, values, index, label, data):
+        horiz, vert = (_AXIS.get(a, a) for a in self.axis[:2])
+        h, v = _DIMS[horiz], _DIMS[vert]
+        y0, y1, dy, x0, x1, dx = (float(s) for s in _RANGE.search(label).groups())
+        index[h] = index[v] = slice(None)
+        target = values[tuple(index)]
+        block = data.reshape(values.shape[v], values.shape[h])
+        if dy < 0:
+            block = block[::-1]
+        if dx < 0:
+            block = block[:, ::-1]
+        np.copyto(target, block if v < h else block.T)
+        for d, a, b, s in ((self.dims[v], y0, y1, dy), (self.dims[h], x0, x1, dx)):
+            if self.edges[d] is None:
+                self.edges[d] = _centers_to_edges(a, b, s)
+
+    def _table(self, values, errors, index, ncols, data):
+        axis = _AXIS.get(self.axis, self.axis)
+        d = _DIMS[axis]
+        index[0] = index[d] = slice(None)
+        block = data.reshape(-1, ncols)
+        if (ncols - 2) // 2 != values.shape[0]:
+            raise ValueError('{} value columns for {} particles'.format(
+                    (ncols - 2) // 2, values.shape[0]))
+        np.copyto(values[tuple(index)], block[:, 2::2].T)
+        if errors is not None:
+            np.copyto(errors[tuple(index)], block[:, 3::2].T)
+        if self.edges[self.dims[d]] is None:
+            self.edges[self.dims[d]] = np.append(block[:, 0], block[-1, 1])
+
+    def centers(self, dim:str) -> np.ndarray:
+        edges = self.edges[dim]
+        return None if edges is None else (edges[1:] + edges[:-1]) / 2
+
+
+# statistics of independent runs
+def combine(values, errors, histories):
+    """ History-weighted mean of independent estimates and its relative error
+
+    values and errors (relative, as in the r.err columns) hold one entry
+    per run along the first axis, histories the number of histories of
+    each run.  Returns (mean, relative error) with the remaining shape.
+    """
+    values = np.asarray(values, dtype=float)
+    errors = np.asarray(errors, dtype=float)
+    w = np.asarray(histories, dtype=float)
+    w = (w / w.sum()).reshape((-1,) + (1,) * (values.ndim - 1))
+    mean = (w * values).sum(axis=0)
+    var = ((w * values * errors) ** 2).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        error = np.where(mean != 0, np.sqrt(var) / np.abs(mean), 0.)
+    return mean, error
+
+
+def _pages(reader) -> dict:
+    if reader.tally is not None:
+        return {'page' + str(n): getattr(reader, 'page' + str(n))
+                for n in reader.tally if reader.tally[n] is not None}
+    return {k: v for k, v in reader.__dict__.items() if k.startswith('page')}
+
+
+def _data(page) -> np.ndarray:
+    return page.values if isinstance(page, TablePage) else page.hc
+
+
+def merge(results:list, histories:list, reader=None):
+    """ Combine tallies of independent runs of the same deck
+
+    results are readers of one class, or file names read with reader
+    (Tally by default).  Every r.err column is combined with the column
+    before it by output_parser.combine, weighted by histories, and TrackXZ
+    meshes, which carry no errors, are averaged the same way.  Other table
+    columns (energy bins, region numbers) are taken from the first run and
+    must agree across runs, else ValueError.  All pages of all runs go
+    through a single vectorized call.  Returns a reader of the first
+    run's class whose pages hold the merged values.
+    """
+    reader = reader or Tally
+    results = [reader(r) if isinstance(r, str) else r for r in results]
+    pages = [_pages(r) for r in results]
+    names = sorted(pages[0], key=lambda k: int(k[4:]))
+    for other in pages[1:]:
+        if sorted(other, key=lambda k: int(k[4:])) != names:
+            raise ValueError('results do not have the same pages')
+    arrays = [[_data(p[k]) for k in names] for p in pages]
+    stacked = np.array([np.concatenate([a.ravel() for a in run])
+                        for run in arrays])
+    # flat positions of value/error pairs and of columns kept as they are
+    value, error, offset = [], [], 0
+    for k, a in zip(names, arrays[0]):
+        page = pages[0][k]
+        index = np.arange(a.size).reshape(a.shape) + offset
+        if isinstance(page, TablePage):
+            for j, name in enumerate(page.names):
+                if j and name.endswith('Err'):
+                    value.append(index[:, j - 1])
+                    error.append(index[:, j])
+        else:
+            value.append(index.ravel())
+            error.append(None)
+        offset += a.size
+    merged = stacked[0].copy()
+    kept = np.ones(merged.size, dtype=bool)
+    for v in value:
+        kept[v] = False
+    for e in error:
+        if e is not None:
+            kept[e] = False
+    if not np.allclose(stacked[:, kept], merged[kept], rtol=1e-9, atol=0):
+        raise ValueError('results do not have the same bins or regions')
+    with_err = [(v, e) for v, e in zip(value, error) if e is not None]
+    if with_err:
+        v = np.concatenate([v for v, _ in with_err])
+        e = np.concatenate([e for _, e in with_err])
+        merged[v], merged[e] = combine(stacked[:, v], stacked[:, e], histories)
+    plain = [v for v, e in zip(value, error) if e is None]
+    if plain:
+        v = np.concatenate(plain)
+        merged[v], _ = combine(stacked[:, v], np.zeros_like(stacked[:, v]),
+                               histories)
+    out = copy.copy(results[0])
+    out.__dict__ = {k: v for k, v in out.__dict__.items()
+                    if not k.startswith('page')}
+    out.tally = None
+    offset = 0
+    for k, a in zip(names, arrays[0]):
+        page = copy.copy(pages[0][k])
+        page.__dict__ = dict(page.__dict__)
+        page.__dict__.pop('_table', None)
+        data = merged[offset:offset + a.size].reshape(a.shape)
+        if isinstance(page, TablePage):
+            page.values = data
+        else:
+            page.hc = data
+        out.__dict__[k] = page
+        offset += a.size
+    out.histories = int(np.sum(histories))
+    return out
+
+
+def write(result, filename:str, template:str=None):
+    """ Write result in ANGEL format, laid out like template
+
+    template (default result.filename) supplies every line that is not
+    data; the numbers of the first data block of each page are replaced
+    by result's, keeping the energy/region columns as written.
+    """
+    template = template or result.filename
+    label = type(result).label
+    lines = {}
+    for p in PageStream(template):
+        found = [b for b in p.blocks if (b.label or '').startswith(label)]
+        k = 'page' + str(p.number)
+        if not found or not found[0].lines or k not in result.__dict__:
+            continue
+        block, page = found[0], result.__dict__[k]
+        if isinstance(page, TablePage):
+            kinds = ['err' if j and n.endswith('Err') else 'keep'
+                     for j, n in enumerate(page.names)]
+            for j, n in enumerate(page.names[:-1]):
+                if kinds[j + 1] == 'err':
+                    kinds[j] = 'value'
+            for i, raw in enumerate(block.lines):
+                tokens = raw.split()
+                for j, kind in enumerate(kinds):
+                    if kind == 'value':
+                        tokens[j] = '{:.4E}'.format(page.values[i, j])
+                    elif kind == 'err':
+                        tokens[j] = '{:.4f}'.format(page.values[i, j])
+                lines[block.start + i] = '  ' + '  '.join(tokens) + '\n'
+        else:
+            flat, pos = page.hc.ravel(), 0
+            for i, raw in enumerate(block.lines):
+                n = len(raw.split())
+                lines[block.start + i] = ''.join(
+                        ' {:.4E}'.format(x) for x in flat[pos:pos + n]) + '\n'
+                pos += n
+    with open(template, 'r') as src, open(filename, 'w') as f:
+        for n, raw in enumerate(src):
+            f.write(lines.get(n, raw))
+
+
+# batch parsing of run directory trees
+_COORD = re.compile(r'^([-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)([A-Za-z]*)$')
+
+
+def _coordinates(root:str, filename:str, names=None) -> dict:
+    """ Sweep coordinates from the directories between root and filename
+
+    '1.0MeV' gives MeV=1.0, a bare number or word gives level<i>; names
+    overrides the column names in directory order.
+    """
+    parts = os.path.relpath(os.path.dirname(filename), root).split(os.sep)
+    parts = [p for p in parts if p not in ('', '.')]
+    coords = {}
+    for i, part in enumerate(parts):
+        m = _COORD.match(part)
+        key = m.group(2) if m and m.group(2) else 'level' + str(i)
+        if names is not None and i < len(names):
+            key = names[i]
+        coords[key] = float(m.group(1)) if m else part
+    return coords
+
+
+def _tidy(args) -> pd.DataFrame:
+    reader, filename = args
+    r = reader(filename)
+    frames = []
+    for name in sorted(k for k in r.__dict__ if k.startswith('page')):
+        page = r.__dict__[name]
+        if 'hc' in page.__dict__:
+            iy, ix = np.indices(page.hc.shape)
+            df = pd.DataFrame({'iy': iy.ravel(), 'ix': ix.ravel(),
+                               'hc': page.hc.ravel()})
+        else:
+            df = page.table.copy()
+        df.insert(0, 'page', int(name[4:]))
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def parse_tree(root:str, pattern:str, reader=None, names=None,
+               workers:int=None, chunksize:int=8) -> pd.DataFrame:
+    """ Parse every file matching pattern below root in a process pool
+
+    A sweep such as recursive_run.py's root/<material>/<E>MeV/<L>cm/ is
+    returned as one DataFrame indexed by the coordinates read from the
+    directory names (see _coordinates), the file name and the page number.
+    workers=1 parses in the calling process.
+    """
+    reader = reader or ForwardCurrent
+    files = sorted(glob.glob(os.path.join(root, '**', pattern), recursive=True))
+    jobs = [(reader, f) for f in files]
+    if workers == 1:
+        tables = list(map(_tidy, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tables = list(pool.map(_tidy, jobs, chunksize=chunksize))
+    frames, index = [], None
+    for filename, df in zip(files, tables):
+        if df is None:
+            continue
+        coords = _coordinates(root, filename, names)
+        df.insert(0, 'file', os.path.basename(filename))
+        for i, (key, value) in enumerate(coords.items()):
+            df.insert(i, key, value)
+        frames.append(df)
+        index = index or list(coords) + ['file', 'page']
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).set_index(index)
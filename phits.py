@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 #!/usr/bin/python3
 
+import os
+import re
+import hashlib
+import itertools
 from string import Formatter
+import numpy as np
 
 
 class InputFileGenerator:
@@ -18,6 +23,8 @@ class InputFileGenerator:
         self.__dict__['sec'+str(j)] = End()
     
     def __str__(self):
+        # sections keep their last rendering until one of their fields
+        # changes, so only the modified sections are formatted again
         return '\n'.join([str(v) for v in self.__dict__.values() if v])
     
     def __repr__(self):
@@ -27,17 +34,275 @@ class InputFileGenerator:
         with open(path, 'w') as f:
             f.write(self.__str__())
 
+    def digest(self) -> str:
+        """ Hash of the canonical rendering, see canonical() """
+        return digest(self.__str__())
+
+    def parameters(self) -> dict:
+        """ Field values keyed 'Section.field', as used by Sweep """
+        return {'{}.{}'.format(type(sec).__name__, f): sec.__dict__[f]
+                for sec in self.__dict__.values()
+                for f in sec._template.fields}
+
+
+_COMMENT = re.compile(r'[%!$#].*')
+# in [ C e l l ] a '#' directly before a number or '(' is a complement
+_CELL_COMMENT = re.compile(r'(?:[%!$]|#(?![\d(])).*')
+
+
+def canonical(text:str) -> str:
+    """ Deck text reduced to what PHITS reads
+
+    Comments (# % ! $ to the end of the line, except # complements in
+    cell regions), blank lines and runs of whitespace are dropped, section
+    headers are written [t-cross] and everything after [ E n d ] is
+    ignored, so cosmetic edits of a deck do not change its digest.
+    """
+    lines, comment = [], _COMMENT
+    for line in text.splitlines():
+        line = ' '.join(comment.sub('', line).split())
+        if not line:
+            continue
+        if line.startswith('[') and ']' in line:
+            name, _, rest = line[1:].partition(']')
+            name = ''.join(name.split()).lower()
+            if name == 'end':
+                break
+            comment = _CELL_COMMENT if name == 'cell' else _COMMENT
+            line = ('[{}] {}'.format(name, rest.strip())).strip()
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def split_sections(text:str) -> list:
+    """ (name, lines) of every section of a deck, name as in canonical()
+
+    Lines keep their indentation (continuation lines matter in [ C e l l ])
+    but lose comments; blank lines and sections switched off are dropped.
+    """
+    sections, lines, comment = [], None, _COMMENT
+    for line in text.splitlines():
+        line = comment.sub('', line).rstrip()
+        stripped = line.strip()
+        if stripped.startswith('[') and ']' in stripped:
+            name, _, rest = stripped[1:].partition(']')
+            name = ''.join(name.split()).lower()
+            if name == 'end':
+                break
+            comment = _CELL_COMMENT if name == 'cell' else _COMMENT
+            lines = []
+            if rest.strip().lower() != 'off':
+                sections.append((name, lines))
+        elif stripped and lines is not None:
+            lines.append(line)
+    return sections
+
+
+def digest(text:str) -> str:
+    """ sha256 of the canonical form of a deck """
+    return hashlib.sha256(canonical(text).encode()).hexdigest()
+
+
+def read_deck(text:str, *sections) -> dict:
+    """ Field values keyed 'Section.field' recovered from a rendered deck
+
+    sections are the Section classes the deck was generated from (all
+    known subclasses by default); values come back as strings.
+    """
+    sections = sections or Section.__subclasses__()
+    found = {}
+    for sec in sections:
+        values = sec._template.match(text)
+        if values is not None:
+            found.update(('{}.{}'.format(sec.__name__, k), v)
+                         for k, v in values.items())
+    return found
+
+
+class Sweep:
+    """ Grid of input decks derived from one InputFileGenerator
+
+    axes maps 'Section.field' (section class name, or 'secN') to the values
+    it takes, e.g. {'Source.e0': [0.1, 1.], 'Surface.dim3': ['5.', '10.']}.
+    mode='product' spans the Cartesian product of the axes, mode='zip'
+    walks them in step and needs axes of equal length.  Sections untouched
+    by the axes are rendered once and shared by every deck, varying
+    sections once per distinct value.
+    """
+    def __init__(self, deck:InputFileGenerator, axes:dict, mode='product'):
+        if mode not in ('product', 'zip'):
+            raise ValueError("mode must be 'product' or 'zip'")
+        self.deck = deck
+        self.axes = {name: list(values) for name, values in axes.items()}
+        self.mode = mode
+        if mode == 'zip' and len({len(v) for v in self.axes.values()}) > 1:
+            message = "zip axes differ in length: {}".format(
+                    {name: len(v) for name, v in self.axes.items()})
+            raise ValueError(message)
+        self._targets = [self._resolve(name) for name in self.axes]
+
+    def _resolve(self, name):
+        secname, _, field = name.partition('.')
+        for key, sec in self.deck.__dict__.items():
+            if secname in (key, type(sec).__name__):
+                break
+        else:
+            message = "InputFile object has no section '{}'".format(secname)
+            raise AttributeError(message)
+        if field not in sec._template.fields:
+            message = "'{}' section has no attribute '{}'".format(
+                    type(sec).__name__, field)
+            raise AttributeError(message)
+        current = type(sec.__dict__[field])
+        for value in self.axes[name]:
+            if current not in [type(None), type(value)]:
+                message = "type mismatch: {} != {}".format(
+                        current.__name__, type(value).__name__)
+                raise ValueError(message)
+        return key, field
+
+    def __len__(self):
+        sizes = [len(v) for v in self.axes.values()]
+        if self.mode == 'zip':
+            return sizes[0] if sizes else 0
+        n = 1
+        for s in sizes:
+            n *= s
+        return n
+
+    def points(self):
+        """ Iterate over the sweep points as tuples in axes order """
+        values = list(self.axes.values())
+        if self.mode == 'zip':
+            return zip(*values)
+        return itertools.product(*values)
+
+    def render(self):
+        """ Yield (point, deck text) for every sweep point """
+        keys = [k for k, v in self.deck.__dict__.items() if v]
+        varying = {}
+        for i, (key, field) in enumerate(self._targets):
+            varying.setdefault(key, []).append((i, field))
+        first = min((keys.index(k) for k in varying), default=len(keys))
+        prefix = [str(self.deck.__dict__[k]) for k in keys[:first]]
+        rest = keys[first:]
+        memo = {key: {} for key in varying}
+        for point in self.points():
+            parts = list(prefix)
+            for key in rest:
+                sec = self.deck.__dict__[key]
+                if key not in varying:
+                    parts.append(str(sec))
+                    continue
+                fields = tuple(point[i] for i, _ in varying[key])
+                text = memo[key].get(fields)
+                if text is None:
+                    values = dict(sec.__dict__)
+                    values.update((f, point[i]) for i, f in varying[key])
+                    text = memo[key][fields] = sec._template.render(values)
+                parts.append(text)
+            yield point, '\n'.join(parts)
+
+    def save(self, path:str):
+        """ Write every deck to path.format(*point, index=i)
+
+        e.g. 'sweep/{0}MeV/{1}cm/phits.in'; returns the written paths.
+        """
+        made, written = set(), []
+        for i, (point, text) in enumerate(self.render()):
+            target = path.format(*point, index=i)
+            folder = os.path.dirname(target)
+            if folder and folder not in made:
+                os.makedirs(folder, exist_ok=True)
+                made.add(folder)
+            with open(target, 'w') as f:
+                f.write(text)
+            written.append(target)
+        return written
+
+
+_CONVERSIONS = {'s': str, 'r': repr, 'a': ascii}
+
+
+class Template:
+    """ Section docstring parsed once: literal fragments, fields and specs """
+    def __init__(self, text):
+        self.text = text or ''
+        self.parts = tuple(Formatter().parse(self.text))
+        self.fields = tuple(dict.fromkeys(
+                fname for _, fname, _, _ in self.parts if fname))
+        # attribute/index lookups and nested specs are left to str.format
+        self._plain = all(fname is None or (fname.isidentifier()
+                          and '{' not in spec) for _, fname, spec, _ in self.parts)
+
+    def render(self, values):
+        if not self._plain:
+            return self.text.format_map(values)
+        out = []
+        for literal, fname, spec, conversion in self.parts:
+            out.append(literal)
+            if fname is not None:
+                value = values[fname]
+                if conversion:
+                    value = _CONVERSIONS[conversion](value)
+                out.append(format(value, spec))
+        return ''.join(out)
+
+    def match(self, text:str):
+        """ Field values, as strings, of a rendering found in text
+
+        Template and text are compared line by line, blank lines ignored.
+        """
+        if '_lines' not in self.__dict__:
+            self._lines = []
+            for line in self.text.split('\n'):
+                if not line.strip():
+                    continue
+                pattern, names = [], []
+                for literal, fname, _, _ in Formatter().parse(line.strip()):
+                    for chunk in re.split(r'(\s+)', literal):
+                        if chunk:
+                            # padding only ever widens the literal gaps
+                            pattern.append(r'\s{%d,}' % len(chunk)
+                                           if chunk.isspace()
+                                           else re.escape(chunk))
+                    if fname:
+                        pattern.append(r'(\S(?:.*?\S)??)')
+                        names.append(fname)
+                regex = re.compile(r'\s*' + ''.join(pattern) + r'\s*$')
+                self._lines.append((regex, names))
+        lines = [l for l in text.split('\n') if l.strip()]
+        n = len(self._lines)
+        for i in range(len(lines) - n + 1):
+            values = {}
+            for j, (regex, names) in enumerate(self._lines):
+                m = regex.match(lines[i + j])
+                if m is None:
+                    break
+                for name, value in zip(names, m.groups()):
+                    values.setdefault(name, value)
+            else:
+                return values
+        return None
+
 
 class Section:    
+    _template = Template('')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._template = Template(cls.__doc__)
+
     def __init__(self):
-        for _, fname, _, _ in Formatter().parse(self.__doc__):
-            if fname:
-                self.__dict__[fname] = None
+        for fname in self._template.fields:
+            self.__dict__[fname] = None
+        self.__dict__['_text'] = None
     
     def __setattr__(self, name, value):
         if name in self.__dict__:
             if type(self.__dict__[name]) in [type(None), type(value)]:
                 self.__dict__[name] = value
+                self.__dict__['_text'] = None
             else:
                 message = "type mismatch: {} != {}".format(
                         type(self.__dict__[name]).__name__,
@@ -52,7 +317,9 @@ class Section:
             raise AttributeError(message)
     
     def __str__(self):
-        return self.__doc__.format(**self.__dict__)
+        if self._text is None:
+            self.__dict__['_text'] = self._template.render(self.__dict__)
+        return self._text
     
     def __repr__(self):
         return self.__str__()
@@ -78,6 +345,8 @@ class Parameters(Section):
      icntl = {icntl: <10}      # (D=0) 3:ECH 5:NOR 6:SRC 7,8:GSH 11:DSH 12:DUMP
     maxcas = {maxcas:<10}      # (D=10) number of particles per one batch
     maxbch = {maxbch:<10}      # (D=10) number of batches
+     itall = {itall: <10}      # (D=0) 1: tally output after every batch
+     rseed = {rseed: <10}      # (D=0.0) initial random seed
      MDBATIMA = {MDBATIMA:<10}
     """
     def __init__(self):
@@ -87,6 +356,8 @@ class Parameters(Section):
         self.icntl  = 0
         self.maxcas = 100
         self.maxbch = 8
+        self.itall  = 0
+        self.rseed  = 0.
         self.MDBATIMA = 5000
 
 
@@ -213,6 +484,146 @@ class Cell(Section):
         self.matNo4 = 3
         self.matDensity4 = '-1.0  -70  34  -35'
 
+class TableSection(Section):
+    """ Section with one line per row, rows kept in columnar numpy arrays
+
+    columns lists (name, dtype) pairs, row formats one line from the
+    column values in that order; a last column named comment is written
+    as a $ comment when not empty.  Rows are added with add() / extend()
+    and removed with remove(); a column is read with section['name'] (a
+    read-only view) and replaced with section['name'] = values.  The whole table is
+    rendered with a single join, linear in the number of rows.
+    """
+    header = ''
+    columns = ()
+    row = ''
+
+    def __init__(self):
+        Section.__init__(self)
+        self.__dict__['_size'] = 0
+        self.__dict__['_data'] = {
+                name: np.empty(16, dtype) for name, dtype in self.columns}
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return True
+
+    def __getitem__(self, name:str) -> np.ndarray:
+        # read-only: edits must go through __setitem__ and friends, which
+        # drop the cached rendering
+        view = self._data[name][:self._size]
+        view.flags.writeable = False
+        return view
+
+    def __setitem__(self, name:str, values):
+        self._data[name][:self._size] = values
+        self.__dict__['_text'] = None
+
+    def _reserve(self, n:int):
+        for name, column in self._data.items():
+            if len(column) < n:
+                grown = np.empty(max(n, 2 * len(column)), column.dtype)
+                grown[:self._size] = column[:self._size]
+                self._data[name] = grown
+
+    def extend(self, **columns):
+        """ Append rows given as equal-length sequences per column;
+        columns left out are filled with '' or 0 """
+        n = len(next(iter(columns.values()))) if columns else 0
+        start, stop = self._size, self._size + n
+        self._reserve(stop)
+        for name, dtype in self.columns:
+            values = columns.pop(name, '' if dtype == object else 0)
+            self._data[name][start:stop] = values
+        if columns:
+            message = "'{}' section has no column '{}'".format(
+                    self.__class__.__name__, next(iter(columns)))
+            raise AttributeError(message)
+        self.__dict__['_size'] = stop
+        self.__dict__['_text'] = None
+        return self
+
+    def add(self, **row):
+        """ Append a single row """
+        return self.extend(**{k: [v] for k, v in row.items()})
+
+    def remove(self, *numbers):
+        """ Drop the rows whose first column is in numbers """
+        first = self[self.columns[0][0]]
+        keep = ~np.isin(first, numbers)
+        n = int(keep.sum())
+        for name in self._data:
+            self._data[name][:n] = self._data[name][:self._size][keep]
+        self.__dict__['_size'] = n
+        self.__dict__['_text'] = None
+        return self
+
+    def _cells(self) -> list:
+        cells = [self[name].tolist() for name, _ in self.columns]
+        if self.columns[-1][0] == 'comment':
+            cells[-1] = ['   $ ' + c if c else '' for c in cells[-1]]
+        return cells
+
+    def __str__(self):
+        if self._text is None:
+            lines = [l.rstrip() for l in map(self.row.format, *self._cells())]
+            self.__dict__['_text'] = '\n'.join([self.header] + lines) + '\n'
+        return self._text
+
+
+class Materials(TableSection):
+    """ [ M a t e r i a l ] with any number of mat[n] entries """
+    header = '[ M a t e r i a l ]'
+    columns = (('no', np.int64), ('composition', object), ('comment', object))
+    row = 'mat[{0}]    {1: <10}{2}'
+
+
+class MatNameColors(TableSection):
+    """ [MatNameColor] with one material number, name and color per row """
+    header = '[MatNameColor]'
+    columns = (('no', np.int64), ('name', object), ('color', object))
+    row = '{0} {1: <20}     {2}'
+
+
+class Surfaces(TableSection):
+    """ [ S u r f a c e ] with one number, type and parameter list per row
+
+    params holds the surface coefficients as one string ('0. 0. 5.'), or
+    a sequence of numbers per row which add()/extend() join.
+    """
+    header = '[ S u r f a c e ]'
+    columns = (('no', np.int64), ('type', object), ('params', object),
+               ('comment', object))
+    row = '    {0: <10}     {1: <10}     {2: <10}{3}'
+
+    def extend(self, **columns):
+        if 'params' in columns:
+            columns['params'] = [
+                    p if isinstance(p, str) else ' '.join(map(str, p))
+                    for p in columns['params']]
+        return TableSection.extend(self, **columns)
+
+
+class Cells(TableSection):
+    """ [ C e l l ] with cell number, material, density and region
+
+    The density is only written for materials > 0, as PHITS expects for
+    void (0) and outer (-1) cells.
+    """
+    header = '[ C e l l ]'
+    columns = (('no', np.int64), ('mat', np.int64), ('density', np.float64),
+               ('region', object), ('comment', object))
+    row = '    {0: <10}    {1: <10}    {2: <10}   {3}{4}'
+
+    def _cells(self) -> list:
+        cells = TableSection._cells(self)
+        filled = self['mat'] > 0
+        cells[2] = np.where(filled, self['density'].astype(str), '').tolist()
+        return cells
+
+
 class T_Track(Section):
     """
 [ T - T r a c k ]
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Static checks of a PHITS deck before it is handed to mpirun """
+
+import re
+import sys
+from phits import split_sections
+
+_MAT = re.compile(r'^\s*m(?:at)?\s*\[?\s*(\d+)\s*\]?', re.I)
+# cell keywords (vol=, u=, fill=, lat=, trcl=(...)) carry no surfaces
+_KEYWORD = re.compile(r'[\w-]+\s*=\s*(?:\([^)]*\)|\S+)')
+_COMPLEMENT = re.compile(r'#\s*(\d+)')
+_SURFACE = re.compile(r'[-+]?\d+')
+_CONTOUR = set('xyzr')
+
+
+class Issue:
+    def __init__(self, level:str, section:str, message:str):
+        self.level = level
+        self.section = section
+        self.message = message
+
+    def __repr__(self):
+        return '{}: [{}] {}'.format(self.level, self.section, self.message)
+
+
+class Report:
+    """ Issues found by check() and the estimated size of every tally
+
+    tallies holds one dict per tally section: its name, output file, bins,
+    memory (bytes per MPI rank) and output (bytes written per axis).
+    """
+    def __init__(self):
+        self.issues = []
+        self.tallies = []
+        self.histories = None
+
+    def error(self, section:str, message:str):
+        self.issues.append(Issue('error', section, message))
+
+    def warning(self, section:str, message:str):
+        self.issues.append(Issue('warning', section, message))
+
+    @property
+    def errors(self) -> list:
+        return [i for i in self.issues if i.level == 'error']
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def raise_errors(self):
+        if self.errors:
+            raise ValueError('deck check failed:\n' + '\n'.join(
+                    repr(i) for i in self.errors))
+        return self
+
+    def __str__(self):
+        lines = [repr(i) for i in self.issues]
+        for t in self.tallies:
+            lines.append('{name:<10} {file:<16} {bins:>12} bins  '
+                         '{memory:>8.1f} MB/rank  {output:>8.1f} MB out'.format(
+                         **dict(t, memory=t['memory'] / 1e6,
+                                output=t['output'] / 1e6)))
+        if self.histories is not None:
+            lines.append('histories: {}'.format(self.histories))
+        return '\n'.join(lines)
+
+
+def _entries(lines:list) -> list:
+    """ Join continuation lines (five leading blanks) to their entry """
+    entries = []
+    for line in lines:
+        if entries and line[:5] == '     ':
+            entries[-1] += ' ' + line.strip()
+        else:
+            entries.append(line.strip())
+    return entries
+
+
+def _numbers(report, name, lines, pattern=None) -> set:
+    found = set()
+    for line in lines:
+        match = pattern.match(line) if pattern else _SURFACE.match(
+                line.strip().lstrip('*+'))
+        if not match:
+            continue
+        number = int(match.group(1) if pattern else match.group(0))
+        if number in found:
+            report.error(name, 'number {} defined twice'.format(number))
+        found.add(number)
+    return found
+
+
+def _pairs(lines:list) -> dict:
+    params = {}
+    for line in lines:
+        key, sep, value = line.partition('=')
+        if sep:
+            params.setdefault(key.strip().lower(), value.strip())
+    return params
+
+
+def _int(params:dict, key:str, default:int=1) -> int:
+    try:
+        return int(float(params[key].split()[0]))
+    except (KeyError, ValueError, IndexError):
+        return default
+
+
+def _tally(report, name:str, params:dict, max_memory:float, max_output:float):
+    mesh = params.get('mesh', 'reg')
+    if mesh == 'xyz':
+        sizes = {a: _int(params, 'n' + a) for a in 'xyz'}
+    elif mesh == 'r-z':
+        sizes = {a: _int(params, 'n' + a) for a in 'rz'}
+    else:
+        # [T-Cross] gives the number of region pairs, others list regions
+        regions = params.get('reg', '1').split()
+        sizes = {'reg': _int(params, 'reg') if name == 't-cross'
+                 else len(regions)}
+    for key, axis in (('ne', 'eng'), ('na', 'a'), ('nt', 't')):
+        sizes[axis] = _int(params, key)
+    parts = len(params.get('part', 'all').split()) or 1
+    bins = parts
+    for n in sizes.values():
+        bins *= n
+    # sum and sum of squares in real*8 per bin and rank
+    memory = 16 * bins
+    output = 0
+    for axis in params.get('axis', 'eng').split():
+        if len(axis) == 2 and set(axis) <= _CONTOUR:
+            per_page = sizes.get(axis[0], 1) * sizes.get(axis[1], 1)
+            output += 12 * bins + 1024 * bins // max(per_page, 1)
+        else:
+            per_page = sizes.get(axis, sizes.get('reg', 1)) * parts
+            output += 26 * bins + 1024 * bins // max(per_page, 1)
+    tally = {'name': name, 'file': params.get('file', '?'), 'bins': bins,
+             'memory': memory, 'output': output}
+    report.tallies.append(tally)
+    if memory > max_memory:
+        report.error(name, '{} bins need {:.1f} GB per rank'.format(
+                bins, memory / 1e9))
+    if output > max_output:
+        report.error(name, 'output of {} estimated at {:.1f} GB'.format(
+                tally['file'], output / 1e9))
+
+
+def check(deck, max_memory:float=4e9, max_output:float=2e9) -> Report:
+    """ Cross-check a deck (InputFileGenerator or its text) statically
+
+    Errors: surfaces, cells (#n) or materials referenced in [ C e l l ]
+    but not defined, numbers defined twice, a material cell without a
+    density, two tallies writing the same file, and tallies whose
+    estimated memory per MPI rank or output size exceeds the limits.
+    Warnings: surfaces and materials never used, colors for unknown
+    materials.
+    """
+    report = Report()
+    sections = split_sections(str(deck))
+    found = {}
+    for name, lines in sections:
+        found.setdefault(name, []).extend(lines)
+    surfaces = _numbers(report, 'surface', _entries(found.get('surface', [])))
+    materials = _numbers(report, 'material', found.get('material', []), _MAT)
+    cells, used_surfaces, used_materials, complements = set(), set(), set(), []
+    for entry in _entries(found.get('cell', [])):
+        tokens = entry.split()
+        if len(tokens) < 2 or 'like' in tokens:
+            continue
+        try:
+            number, mat = int(tokens[0]), int(tokens[1])
+        except ValueError:
+            report.error('cell', 'cannot read {!r}'.format(entry))
+            continue
+        if number in cells:
+            report.error('cell', 'number {} defined twice'.format(number))
+        cells.add(number)
+        rest = tokens[2:]
+        if mat > 0:
+            used_materials.add(mat)
+            if mat not in materials:
+                report.error('cell', 'cell {} uses undefined material {}'.format(
+                        number, mat))
+            try:
+                float(rest[0])
+                rest = rest[1:]
+            except (IndexError, ValueError):
+                report.error('cell', 'cell {} has no density'.format(number))
+        region = _KEYWORD.sub(' ', ' '.join(rest))
+        complements += [(number, int(c)) for c in _COMPLEMENT.findall(region)]
+        for s in _SURFACE.findall(_COMPLEMENT.sub(' ', region)):
+            s = abs(int(s))
+            used_surfaces.add(s)
+            if s not in surfaces:
+                report.error('cell', 'cell {} uses undefined surface {}'.format(
+                        number, s))
+    for number, other in complements:
+        if other not in cells:
+            report.error('cell', 'cell {} complements undefined cell {}'.format(
+                    number, other))
+    if 'cell' in found:
+        for s in sorted(surfaces - used_surfaces):
+            report.warning('surface', 'surface {} is not used'.format(s))
+        for m in sorted(materials - used_materials):
+            report.warning('material', 'material {} is not used'.format(m))
+    for line in found.get('matnamecolor', []):
+        number = _SURFACE.match(line.strip())
+        if number and int(number.group(0)) not in materials:
+            report.warning('matnamecolor', 'material {} is not defined'.format(
+                    number.group(0)))
+    files = {}
+    for name, lines in sections:
+        params = _pairs(lines)
+        if not name.startswith('t-') or 'mesh' not in params:
+            continue
+        _tally(report, name, params, max_memory, max_output)
+        file = params.get('file')
+        if file in files:
+            report.error(name, 'writes {} like [{}]'.format(file, files[file]))
+        files.setdefault(file, name)
+    params = _pairs(found.get('parameters', []))
+    report.histories = _int(params, 'maxcas', 10) * _int(params, 'maxbch', 10)
+    return report
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1]) as f:
+        report = check(f.read())
+    print(report)
+    sys.exit(0 if report.ok else 1)
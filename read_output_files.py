@@ -15,13 +15,15 @@ fcurrFile = output_parser.ForwardCurrent(root + 'T100-fcurr.out')
 txzFile   = output_parser.TrackXZ(root + 'T100-t_xz.out')
 
 """ plot track_xz"""
+# hc rows run from ymax down to ymin; page.nx is the number of rows and
+# page.ny the number of columns
 Z = txzFile.page10.hc
-x = np.arange(txzFile.page10.xmin, txzFile.page10.xmax, txzFile.page10.dx)  # len = 11
-y = np.arange(txzFile.page10.ymin, txzFile.page10.ymax+1, txzFile.page10.dy)  # len = 7
+x = np.linspace(txzFile.page10.xmin, txzFile.page10.xmax, txzFile.page10.ny)
+y = np.linspace(txzFile.page10.ymax, txzFile.page10.ymin, txzFile.page10.nx)
 
 
 fig, ax = plt.subplots()
-pcm = ax.pcolormesh(x, y, Z)
+pcm = ax.pcolormesh(x, y, Z, shading='nearest')
 fig.colorbar(pcm, ax=ax)
 
 """ plot fcurr"""
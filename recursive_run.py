@@ -12,12 +12,22 @@ from phits import InputFileGenerator, Title, Parameters, Source
 from phits import Material, MatNameColor, Surface, Cell
 from phits import T_Track, T_Cross_reg, T_Cross_rz, T_3Dshow
 import output_parser
-import subprocess
+from length_search import LengthSearch
+from adaptive_run import AdaptiveRun
+from run_cache import RunCache
+from journal import Journal
+import preflight
 import numpy as np
 import os
 
 
 
+# finished runs by deck hash, so restarts do not simulate a deck twice
+cache = RunCache(root + '.runcache', salt=phitsexe)
+# every finished length is journaled; after a crash the searches replay
+# from it without running PHITS and continue where they stopped
+journal = Journal(root + 'sweep.journal')
+
 nEnergy = [0.001, 0.01, 0.1, 1., 10.]
 
 mat  = {'Au':['Au',
@@ -53,7 +63,7 @@ for label,value in mat.items():
 		inFile.sec1.maxcas = 100000
 		inFile.sec2.proj = 'neutron'
 		inFile.sec2.e0 = neutronEnergy
-		inFile.sec5.dim3  = TargetLength
+		inFile.sec5.dim3  = str(TargetLength)
 		inFile.sec5.dim4 = '50.0'
 		inFile.sec6.matDensity3 = value[1]
 		inFile.sec3.mat2  = value[2]
@@ -62,38 +72,35 @@ for label,value in mat.items():
 		inFile.sec8.energyMesh = '0.0 2.5e3'
 
 
-		while True:
-			path = root + label + '/' + str(neutronEnergy) + 'MeV' + '/' + str(TargetLength) + 'cm' + '/'
+		def measure(path):
+			fcurrFile = output_parser.ForwardCurrent(path + '/cross_rz.out')
+			current = fcurrFile.page1.table.neutron[0]*fcurrFile.page1.wt.area
+			return current, fcurrFile.page1.table.nErr[0]
+
+		def simulate(length, path):
+			inFile.sec5.dim3 = str(length)
+			# refuse broken geometry or oversized tallies before mpirun
+			preflight.check(inFile).raise_errors()
 			os.makedirs(path, exist_ok=True)
-			os.chdir(path)
 			inFile.save(path + 'phits.in')
 
-			bashCommand =  ['mpirun -np 45 '+ phitsexe]
-			print('Target Material:', label,'Target Length:', TargetLength, 'Neutron Energy:', neutronEnergy)
-			process = subprocess.Popen(bashCommand, shell=True,
-									   stdout=subprocess.PIPE,
-									   stderr=subprocess.PIPE,
-									   universal_newlines=True
-									   )
-			
-			stdoutFile = open(path + 'stdout.txt', 'a')
-			stderrFile = open(path + 'stderr.txt', 'a')
-			while process.poll() is None:
-				stdout = process.stdout.readline()
-				stderr = process.stderr.readline()
-				print(stdout.rstrip())
-				stdoutFile.write(stdout)
-				stderrFile.write(stderr)
-				
-			stdoutFile.close()
-			stderrFile.close()
-
-			fcurrFile = output_parser.ForwardCurrent(path + 'cross_rz.out')
-			if ((fcurrFile.page1.table.neutron[0]*fcurrFile.page1.wt.area > 0.001) and (fcurrFile.page1.table.nErr[0] < 0.1)):
-			   TargetLength = TargetLength + 5.0
-			   inFile.sec5.dim3  = TargetLength
-			else:
-				break
+			bashCommand = ['mpirun', '-np', '45', phitsexe]
+			print('Target Material:', label,'Target Length:', length, 'Neutron Energy:', neutronEnergy)
+			# start at 10000 histories/batch, escalate only while undecided,
+			# and stop a stage as soon as its per-batch tallies settle it
+			decision = AdaptiveRun(inFile, path, measure, 0.001, bashCommand,
+								   max_error=0.1, maxcas=10000,
+								   max_histories=100000*inFile.sec1.maxbch,
+								   echo=True, early=True, cache=cache).run()
+			return decision.passed, decision.value
+
+		def evaluate(length):
+			path = root + label + '/' + str(neutronEnergy) + 'MeV' + '/' + str(length) + 'cm' + '/'
+			return journal.call(path, simulate, length, path)
+
+		# bracket + bisect on the 5 cm grid instead of stepping through it
+		search = LengthSearch(evaluate, start=TargetLength, step=5.0, threshold=0.001)
+		TargetLength = search.run()
 			
 #			phitsFile = output_parser.Phits(path + 'phits.out')
 #			LeakNeutronIndex = np.where(phitsFile.leak.name =='neutron')
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" SQLite store of parsed sweep results with indexed parameter queries """
+
+import os
+import glob
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+import output_parser
+from phits import read_deck
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, dir TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, run INTEGER, name TEXT, size INTEGER,
+    mtime INTEGER, UNIQUE (run, name));
+CREATE TABLE IF NOT EXISTS params (
+    run INTEGER, name TEXT, value TEXT, num REAL, PRIMARY KEY (run, name));
+CREATE INDEX IF NOT EXISTS params_num ON params (name, num);
+CREATE INDEX IF NOT EXISTS params_value ON params (name, value);
+CREATE TABLE IF NOT EXISTS pages (
+    file INTEGER, page INTEGER, columns TEXT, shape TEXT, data BLOB,
+    wt TEXT, PRIMARY KEY (file, page));
+"""
+
+
+def _num(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResultDB:
+    """ Parsed tallies and deck parameters of a sweep in one SQLite file
+
+    ingest() walks a run tree, storing for every run directory the fields
+    of its deck (phits.read_deck, keyed 'Section.field') and the
+    directory coordinates ('path.MeV', ...) as indexed parameters, and
+    the pages of its tally files as arrays.  Files whose size and mtime
+    are unchanged since the last ingest are skipped.
+    """
+    def __init__(self, path:str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def _run(self, folder:str) -> int:
+        self.db.execute('INSERT OR IGNORE INTO runs (dir) VALUES (?)', (folder,))
+        return self.db.execute(
+                'SELECT id FROM runs WHERE dir = ?', (folder,)).fetchone()[0]
+
+    def _changed(self, run:int, filename:str):
+        """ files.id to (re)fill, or None if filename is already stored """
+        st = os.stat(filename)
+        name = os.path.basename(filename)
+        row = self.db.execute(
+                'SELECT id, size, mtime FROM files WHERE run = ? AND name = ?',
+                (run, name)).fetchone()
+        if row is not None and row[1:] == (st.st_size, st.st_mtime_ns):
+            return None
+        if row is not None:
+            self.db.execute('DELETE FROM pages WHERE file = ?', (row[0],))
+            self.db.execute('UPDATE files SET size = ?, mtime = ? WHERE id = ?',
+                            (st.st_size, st.st_mtime_ns, row[0]))
+            return row[0]
+        return self.db.execute(
+                'INSERT INTO files (run, name, size, mtime) VALUES (?, ?, ?, ?)',
+                (run, name, st.st_size, st.st_mtime_ns)).lastrowid
+
+    def _params(self, run:int, params:dict):
+        self.db.executemany(
+                'INSERT OR REPLACE INTO params VALUES (?, ?, ?, ?)',
+                [(run, k, str(v), _num(v)) for k, v in params.items()])
+
+    def ingest(self, root:str, pattern:str='*.out', reader=None,
+               deck:str='phits.in', names=None) -> int:
+        """ Add new or changed runs below root; returns files (re)parsed """
+        reader = reader or output_parser.Tally
+        files = sorted(glob.glob(os.path.join(root, '**', pattern),
+                                 recursive=True))
+        count = 0
+        with self.db:
+            for filename in files:
+                folder = os.path.dirname(os.path.abspath(filename))
+                run = self._run(folder)
+                path = os.path.join(folder, deck)
+                if os.path.exists(path) and self._changed(run, path) is not None:
+                    # fields gone from a changed deck must not match any more
+                    self.db.execute("DELETE FROM params WHERE run = ? AND "
+                                    "substr(name, 1, 5) != 'path.'", (run,))
+                    with open(path) as f:
+                        self._params(run, read_deck(f.read()))
+                coords = output_parser._coordinates(root, filename, names)
+                self._params(run, {'path.' + k: v for k, v in coords.items()})
+                file_id = self._changed(run, filename)
+                if file_id is None:
+                    continue
+                self._pages(file_id, reader(filename))
+                count += 1
+        return count
+
+    def _pages(self, file_id:int, result):
+        rows = []
+        for name, page in output_parser._pages(result).items():
+            data = output_parser._data(page)
+            columns = getattr(page, 'names', None)
+            wt = ({k: v for k, v in page.wt.__dict__.items()}
+                  if 'wt' in page.__dict__ else {})
+            rows.append((file_id, int(name[4:]), json.dumps(columns),
+                         json.dumps(data.shape),
+                         np.ascontiguousarray(data, dtype=float).tobytes(),
+                         json.dumps(wt)))
+        self.db.executemany('INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def _where(self, where:dict):
+        joins, args = [], []
+        for i, (name, value) in enumerate((where or {}).items()):
+            field = 'num' if _num(value) is not None else 'value'
+            joins.append('JOIN params w{0} ON w{0}.run = files.run '
+                         'AND w{0}.name = ? AND w{0}.{1} = ?'.format(i, field))
+            args += [name, _num(value) if field == 'num' else str(value)]
+        return ' '.join(joins), args
+
+    def select(self, column:str, file:str, x:str, where:dict=None,
+               page:int=1, row:int=0) -> pd.DataFrame:
+        """ column of table row `row` on page `page` of file against the
+        parameter x, for the runs matching where, e.g.
+        select('neutron', 'cross_rz.out', 'Surface.dim3',
+               {'Material.mat2': 'Pb  1.0', 'Source.e0': 1.0})
+        """
+        joins, args = self._where(where)
+        sql = ('SELECT px.num, px.value, pages.columns, pages.shape, '
+               'pages.data, runs.dir FROM pages '
+               'JOIN files ON files.id = pages.file '
+               'JOIN runs ON runs.id = files.run '
+               'JOIN params px ON px.run = files.run AND px.name = ? '
+               + joins + ' WHERE files.name = ? AND pages.page = ?')
+        out = []
+        for num, value, columns, shape, data, folder in self.db.execute(
+                sql, [x] + args + [file, page]):
+            columns = json.loads(columns)
+            table = np.frombuffer(data).reshape(json.loads(shape))
+            out.append((num if num is not None else value,
+                        table[row, columns.index(column)], folder))
+        df = pd.DataFrame(out, columns=[x, column, 'dir'])
+        return df.sort_values(x, ignore_index=True)
+
+    def query(self, sql:str, *args) -> pd.DataFrame:
+        return pd.read_sql_query(sql, self.db, params=args)
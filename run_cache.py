@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Content-addressed cache of finished PHITS runs """
+
+import os
+import shutil
+import hashlib
+import tempfile
+import runner
+from phits import digest
+
+
+class RunCache:
+    """ Outputs of completed runs stored under the digest of their deck
+
+    Entries are directories <directory>/<key[:2]>/<key> holding every file
+    the run left in its workdir.  A deck whose canonical text (see
+    phits.canonical) was simulated before is served from there instead of
+    calling PHITS again.  salt is mixed into the key, e.g. the executable,
+    so that results of different PHITS builds are kept apart.
+    """
+    def __init__(self, directory:str, salt:str='',
+                 exclude=('progress.json',)):
+        self.directory = directory
+        self.salt = salt
+        self.exclude = set(exclude)
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, deck) -> str:
+        text = str(deck)
+        if not hasattr(deck, 'save') and os.path.exists(text):
+            with open(text) as f:
+                text = f.read()
+        key = digest(text)
+        if self.salt:
+            key = hashlib.sha256((self.salt + key).encode()).hexdigest()
+        return key
+
+    def path(self, key:str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, deck, workdir:str) -> bool:
+        """ Fill workdir with the cached outputs of deck; False on a miss """
+        entry = self.path(self.key(deck))
+        if not os.path.isdir(entry):
+            return False
+        os.makedirs(workdir, exist_ok=True)
+        for name in os.listdir(entry):
+            target = os.path.join(workdir, name)
+            # copies, not links: PHITS rewrites its outputs in place
+            shutil.copyfile(os.path.join(entry, name), target)
+        return True
+
+    def store(self, deck, workdir:str) -> str:
+        """ Copy the files of a finished run in workdir into the cache """
+        entry = self.path(self.key(deck))
+        if os.path.isdir(entry):
+            return entry
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.tmp')
+        for name in os.listdir(workdir):
+            source = os.path.join(workdir, name)
+            if name not in self.exclude and os.path.isfile(source):
+                shutil.copyfile(source, os.path.join(tmp, name))
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # stored meanwhile by a concurrent run of the same deck
+            shutil.rmtree(tmp)
+        return entry
+
+    def run(self, deck, workdir:str, command:list, echo:bool=False,
+            **kwargs) -> bool:
+        """ Outputs of deck in workdir, running command there only on a
+        miss; returns True on a hit.  kwargs go to runner.run """
+        if self.fetch(deck, workdir):
+            return True
+        runner.Job(deck, workdir).prepare()
+        returncode = runner.run(command, workdir, echo=echo, **kwargs)
+        if returncode == 0:
+            self.store(deck, workdir)
+        return False
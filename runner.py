@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+""" Run PHITS jobs concurrently within a core budget """
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+from monitor import Progress
+
+PHITS = '/opt/PHITS/phits/bin/phits323_lin_mpi.exe'
+# stand-in executable for trying the runner without PHITS
+DUMMY = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(
+        __file__)), 'dummy_phits.py')]
+
+
+class Job:
+    """ One PHITS run: a deck, the directory it runs in and its MPI ranks
+
+    deck is an InputFileGenerator (saved as workdir/phits.in) or the path
+    of an existing input file (copied there).  stop, if given, is polled
+    while the job runs and ends it early when it returns True (see run).
+    """
+    def __init__(self, deck, workdir:str, np:int=1, name:str=None, stop=None):
+        self.deck = deck
+        self.stop = stop
+        self.workdir = workdir
+        self.np = np
+        self.name = name or os.path.basename(os.path.normpath(workdir))
+
+    def prepare(self, deckname:str='phits.in') -> str:
+        os.makedirs(self.workdir, exist_ok=True)
+        path = os.path.join(self.workdir, deckname)
+        if hasattr(self.deck, 'save'):
+            self.deck.save(path)
+        elif os.path.abspath(self.deck) != os.path.abspath(path):
+            shutil.copyfile(self.deck, path)
+        return path
+
+
+class Result:
+    def __init__(self, job:Job, returncode:int, elapsed:float):
+        self.job = job
+        self.returncode = returncode
+        self.elapsed = elapsed
+        self.stdout = os.path.join(job.workdir, 'stdout.txt')
+        self.stderr = os.path.join(job.workdir, 'stderr.txt')
+
+    def __repr__(self):
+        return 'Result({}, returncode={}, elapsed={:.1f}s)'.format(
+                self.job.name, self.returncode, self.elapsed)
+
+
+async def _pump(stream, f, echo=None):
+    async for line in stream:
+        f.write(line)
+        # batch lines reach the file at once for monitor.Progress
+        if b'bat[' in line:
+            f.flush()
+        if echo is not None:
+            echo(line)
+
+
+async def _watch(process, stop, interval:float, grace:float=10.):
+    """ Terminate process (kill after grace seconds) once stop() is true """
+    while process.returncode is None:
+        await asyncio.sleep(interval)
+        if process.returncode is None and stop():
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), grace)
+            except asyncio.TimeoutError:
+                process.kill()
+            return
+
+
+async def _capture(command:list, cwd:str, echo=None, append:bool=False,
+                   stop=None, interval:float=5.):
+    """ Run command in cwd, pumping both pipes into cwd/stdout.txt and
+    cwd/stderr.txt concurrently; echo(line) sees every stdout line and
+    stop() is asked every interval seconds whether to end the run """
+    mode = 'ab' if append else 'wb'
+    with open(os.path.join(cwd, 'stdout.txt'), mode, buffering=1 << 16) as out, \
+         open(os.path.join(cwd, 'stderr.txt'), mode, buffering=1 << 16) as err:
+        process = await asyncio.create_subprocess_exec(
+                *command, cwd=cwd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE)
+        watch = None
+        if stop is not None:
+            watch = asyncio.ensure_future(_watch(process, stop, interval))
+        try:
+            await asyncio.gather(
+                    _pump(process.stdout, out, echo),
+                    _pump(process.stderr, err))
+            return await process.wait()
+        finally:
+            if watch is not None:
+                watch.cancel()
+
+
+def _print(line:bytes):
+    print(line.decode(errors='replace').rstrip())
+
+
+def run(command:list, cwd:str, echo:bool=False, append:bool=False,
+        stop=None, interval:float=5.) -> int:
+    """ Run command in cwd and return its exit code
+
+    Both pipes are read concurrently by asyncio streams and written to
+    buffered stdout.txt / stderr.txt in cwd, so a chatty MPI run neither
+    blocks on a full pipe nor costs CPU in a polling loop.  echo tails
+    stdout to the console; append keeps the logs of earlier runs.  If
+    stop is given it is called every interval seconds while the run is
+    going and the run is terminated as soon as it returns True.
+    """
+    return asyncio.run(_capture(
+            command, cwd, _print if echo else None, append, stop, interval))
+
+
+class Scheduler:
+    """ Pack jobs onto a fixed number of cores with asyncio
+
+    A job starts as soon as np of the cores are free, so e.g. four 12-rank
+    runs share a 48-core node instead of queuing behind each other.  Both
+    output pipes of every job are streamed to stdout.txt / stderr.txt in
+    its workdir (and echoed with a job prefix if echo is set).  mpirun=None
+    runs the executable directly, as for the DUMMY stand-in.
+
+    With monitor set to an interval in seconds every running job is
+    followed by a monitor.Progress: progress(status) is called with its
+    status dict that often and workdir/progress.json is kept current.
+    Job.stop is polled every interval seconds; a stopped job frees its
+    cores for the next one at once.  With a journal.Journal, job states
+    are logged under the job name and jobs already done are not run again
+    after a restart.
+    """
+    def __init__(self, cores:int, executable=PHITS, mpirun='mpirun',
+                 echo:bool=False, deckname:str='phits.in',
+                 monitor:float=None, progress=None, interval:float=5.,
+                 journal=None):
+        self.cores = cores
+        self.executable = (
+                [executable] if isinstance(executable, str) else list(executable))
+        self.mpirun = mpirun
+        self.echo = echo
+        self.deckname = deckname
+        self.monitor = monitor
+        self.progress = progress
+        self.interval = interval
+        self.journal = journal
+        self._free = cores
+        self._cond = None
+        self._loop = None
+
+    def command(self, job:Job) -> list:
+        if self.mpirun is None:
+            return list(self.executable)
+        return [self.mpirun, '-np', str(job.np)] + self.executable
+
+    def submit(self, job:Job, callback=None) -> asyncio.Future:
+        """ Schedule job on the running loop; callback(future) on completion """
+        if self.journal is not None and self.journal.state(job.name) is None:
+            self.journal.record(job.name, 'queued')
+        future = asyncio.ensure_future(self._run(job))
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def _condition(self) -> asyncio.Condition:
+        # a Condition belongs to one event loop and every run() starts a
+        # new one, so the core budget is reset along with it
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._cond, self._free = loop, asyncio.Condition(), self.cores
+        return self._cond
+
+    async def _acquire(self, n:int):
+        async with self._condition():
+            await self._cond.wait_for(lambda: self._free >= n)
+            self._free -= n
+
+    async def _release(self, n:int):
+        async with self._condition():
+            self._free += n
+            self._cond.notify_all()
+
+    async def _run(self, job:Job) -> Result:
+        if self.journal is not None and self.journal.state(job.name) == 'done':
+            done = self.journal.jobs[job.name]
+            return Result(job, done['returncode'], done['elapsed'])
+        n = min(job.np, self.cores)
+        job.prepare(self.deckname)
+        await self._acquire(n)
+        start = time.time()
+        if self.journal is not None:
+            self.journal.record(job.name, 'running', workdir=job.workdir)
+        echo = None
+        if self.echo:
+            prefix = '[{}] '.format(job.name)
+            echo = lambda line: print(prefix + line.decode(errors='replace').rstrip())
+        watch = None
+        if self.monitor:
+            progress = Progress(job.workdir, job.name, deckname=self.deckname)
+            watch = asyncio.ensure_future(
+                    progress.follow(self.monitor, self.progress, dump=True))
+        returncode = None
+        try:
+            returncode = await _capture(self.command(job), job.workdir, echo,
+                                        stop=job.stop, interval=self.interval)
+        finally:
+            if self.journal is not None:
+                done = returncode == 0 or getattr(job.stop, 'stopped', False)
+                self.journal.record(
+                        job.name, 'done' if done else 'failed',
+                        returncode=returncode, elapsed=time.time() - start)
+            await self._release(n)
+            if watch is not None:
+                watch.cancel()
+                status = progress.dump()
+                if self.progress is not None:
+                    self.progress(status)
+        return Result(job, returncode, time.time() - start)
+
+    async def gather(self, jobs, callback=None) -> list:
+        return await asyncio.gather(*[self.submit(j, callback) for j in jobs])
+
+    def run(self, jobs, callback=None) -> list:
+        """ Blocking helper: run all jobs and return their Results in order """
+        return asyncio.run(self.gather(jobs, callback))
+
+
+def check(folder:str=None) -> bool:
+    """ Run three 2-rank DUMMY jobs on 2 cores twice with one Scheduler;
+    the second run() must not hang on the first run's event loop """
+    import tempfile
+    folder = folder or tempfile.mkdtemp(prefix='phits_runner_')
+    deck = os.path.join(folder, 'phits.in')
+    with open(deck, 'w') as f:
+        f.write('maxcas = 10\nmaxbch = 2\n')
+    scheduler = Scheduler(2, DUMMY, mpirun=None)
+    for attempt in range(2):
+        jobs = [Job(deck, os.path.join(folder, 'run{}'.format(i)), np=2)
+                for i in range(3)]
+        results = asyncio.run(asyncio.wait_for(scheduler.gather(jobs), 60))
+        assert [r.returncode for r in results] == [0, 0, 0], results
+    return True
+
+
+if __name__ == '__main__':
+    print('scheduler check passed' if check() else 'scheduler check failed')